@@ -4,11 +4,12 @@ FastAPI应用主文件
 
 import asyncio
 import sys
+import orjson
 from pathlib import Path
-from fastapi import FastAPI, WebSocket, WebSocketDisconnect, HTTPException, BackgroundTasks
+from fastapi import FastAPI, WebSocket, WebSocketDisconnect, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import FileResponse
-from typing import Dict
+from typing import Dict, Optional
 import logging
 
 # 添加父目录到路径
@@ -56,40 +57,99 @@ logger = setup_logger("API")
 # WebSocket连接管理
 class ConnectionManager:
     def __init__(self):
-        self.active_connections: Dict[str, WebSocket] = {}
+        # 同一个task_id可以有多个客户端（例如多个浏览器标签页）
+        self.active_connections: Dict[str, list] = {}
+        self._queues: Dict[str, asyncio.Queue] = {}
+        self._writers: Dict[str, asyncio.Task] = {}
 
     async def connect(self, task_id: str, websocket: WebSocket):
         await websocket.accept()
-        self.active_connections[task_id] = websocket
+        self.active_connections.setdefault(task_id, []).append(websocket)
+
+        # 每个task一个消息队列 + 批量发送协程，避免每条消息一个WS帧
+        if task_id not in self._queues:
+            self._queues[task_id] = asyncio.Queue()
+            self._writers[task_id] = asyncio.create_task(self._writer_loop(task_id))
+
         logger.info(f"WebSocket连接建立: task_id={task_id}")
 
-    def disconnect(self, task_id: str):
-        if task_id in self.active_connections:
+    def disconnect(self, task_id: str, websocket: Optional[WebSocket] = None):
+        clients = self.active_connections.get(task_id)
+        if clients is None:
+            return
+
+        if websocket is None:
+            clients.clear()
+        elif websocket in clients:
+            clients.remove(websocket)
+
+        # 最后一个客户端断开时回收队列和发送协程
+        if not clients:
             del self.active_connections[task_id]
+            writer = self._writers.pop(task_id, None)
+            if writer:
+                writer.cancel()
+            self._queues.pop(task_id, None)
             logger.info(f"WebSocket连接断开: task_id={task_id}")
 
+    async def _writer_loop(self, task_id: str):
+        """批量发送循环：取空队列中所有就绪消息，合并为一个batch帧发送"""
+        queue = self._queues[task_id]
+
+        try:
+            while True:
+                # 至少等到一条消息，然后把队列里能立即取到的全部取出
+                items = [await queue.get()]
+                while True:
+                    try:
+                        items.append(queue.get_nowait())
+                    except asyncio.QueueEmpty:
+                        break
+
+                # 合并连续的stats消息，只发送最新快照
+                coalesced = []
+                for item in items:
+                    if (
+                        coalesced
+                        and item["type"] == "stats"
+                        and coalesced[-1]["type"] == "stats"
+                    ):
+                        coalesced[-1] = item
+                    else:
+                        coalesced.append(item)
+
+                # 只编码一次，广播给该task的所有客户端
+                # 发送失败视为连接已死：立即摘除该客户端，后续事件不再为它
+                # 反复付出异常构造和错误日志的开销
+                payload = orjson.dumps({"type": "batch", "items": coalesced}).decode()
+                for websocket in list(self.active_connections.get(task_id, ())):
+                    try:
+                        await websocket.send_text(payload)
+                    except Exception as e:
+                        logger.warning(f"连接已失效，移除客户端: task_id={task_id}, 原因: {str(e)}")
+                        self.disconnect(task_id, websocket)
+
+        except asyncio.CancelledError:
+            pass
+
     async def send_log(self, task_id: str, level: str, message: str):
-        """发送日志消息"""
-        if task_id in self.active_connections:
-            try:
-                await self.active_connections[task_id].send_json({
-                    "type": "log",
-                    "level": level,
-                    "data": message
-                })
-            except Exception as e:
-                logger.error(f"发送日志失败: {str(e)}")
+        """发送日志消息（入队，由批量发送协程统一发送）"""
+        queue = self._queues.get(task_id)
+        if queue:
+            queue.put_nowait({
+                "type": "log",
+                "level": level,
+                "data": message
+            })
 
     async def send_stats(self, task_id: str, stats: Dict):
-        """发送统计更新"""
-        if task_id in self.active_connections:
-            try:
-                await self.active_connections[task_id].send_json({
-                    "type": "stats",
-                    "data": stats
-                })
-            except Exception as e:
-                logger.error(f"发送统计失败: {str(e)}")
+        """发送统计更新（入队，由批量发送协程统一发送）"""
+        queue = self._queues.get(task_id)
+        if queue:
+            queue.put_nowait({
+                "type": "stats",
+                "data": stats
+            })
 
 
 manager = ConnectionManager()
@@ -97,6 +157,8 @@ manager = ConnectionManager()
 
 async def run_generation_task(task_id: str, config: GenerationConfig):
     """后台运行生成任务"""
+    llm_client = None
+
     try:
         # 更新任务状态
         await task_manager.start_task(task_id)
@@ -121,7 +183,11 @@ async def run_generation_task(task_id: str, config: GenerationConfig):
         synthesizer = DataSynthesizer(llm_client, enable_smart_rejected=True)
 
         # 启用LLM自评验证（将llm_client传给validator）
-        validator = Validator(strict_mode=config.strict_validation, llm_client=llm_client)
+        validator = Validator(
+            strict_mode=config.strict_validation,
+            llm_client=llm_client,
+            concurrency=config.concurrency
+        )
 
         ensure_dir(config.output_dir)
         exporter = Exporter(config.output_dir)
@@ -133,21 +199,23 @@ async def run_generation_task(task_id: str, config: GenerationConfig):
             concurrency=config.concurrency
         )
 
-        # 添加进度回调
-        last_completed = [0]  # 记录上次已完成的任务数
+        # 添加进度回调（由引擎的刷新协程按间隔调用，无需create_task）
+        last_logged_pct = [-1]  # 记录上次写进度日志时的整数百分比
 
-        def progress_callback(stats: ProgressStats):
-            asyncio.create_task(task_manager.update_progress(task_id, stats.progress_percent, stats.to_dict()))
-            asyncio.create_task(manager.send_stats(task_id, stats.to_dict()))
+        async def progress_callback(stats: ProgressStats):
+            stats_dict = stats.to_dict()
+            await task_manager.update_progress(task_id, stats.progress_percent, stats_dict)
+            await manager.send_stats(task_id, stats_dict)
 
-            # 每完成一个任务发送日志
-            if stats.completed_tasks > last_completed[0]:
-                last_completed[0] = stats.completed_tasks
-                asyncio.create_task(manager.send_log(
+            # 只在整数百分比前进时写日志：日志量从N条降到最多100条
+            pct = int(stats.progress_percent)
+            if pct > last_logged_pct[0]:
+                last_logged_pct[0] = pct
+                await manager.send_log(
                     task_id,
                     "info",
                     f"进度: 已完成 {stats.completed_tasks}/{stats.total_tasks} 个任务 ({stats.progress_percent:.1f}%)"
-                ))
+                )
 
         engine.add_progress_callback(progress_callback)
 
@@ -174,14 +242,20 @@ async def run_generation_task(task_id: str, config: GenerationConfig):
 
         await manager.send_log(task_id, "success", f"任务生成完成: {len(tasks)} 个")
 
+        # 任务已生成，提前释放注册中心和任务生成器，降低LLM阶段的峰值内存
+        task_generator = None
+        tool_registry = None
+
         # 并发处理
         await manager.send_log(task_id, "info", f"开始并发处理（并发度={config.concurrency}）...")
 
-        valid_samples, invalid_samples = await engine.process_tasks(
+        process_coro = engine.process_tasks(
             tasks=tasks,
             enable_validation=True,
             enable_correction=config.auto_correction
         )
+        tasks = None  # 引擎内部用deque消费任务，这里不再保留引用
+        valid_samples, invalid_samples = await process_coro
 
         # 获取最终统计数据
         final_stats = engine.get_stats()
@@ -205,23 +279,22 @@ async def run_generation_task(task_id: str, config: GenerationConfig):
         )
         await manager.send_log(task_id, "success", f"数据已导出: {len(file_paths)} 个文件")
 
-        await manager.send_log(task_id, "info", "生成dataset_info.json...")
-        dataset_info_path = exporter.generate_dataset_info(
+        await manager.send_log(task_id, "info", "生成dataset_info.json与统计信息...")
+        stats = engine.get_stats()
+        artifacts = exporter.export_run_artifacts(
+            stats=stats,
+            invalid_samples=invalid_samples,
             dataset_name="tool_dpo_dataset",
             file_name="data_dpo.jsonl" if len(file_paths) == 1 else "data_dpo_*.jsonl",
-            config=config.dict()
+            config=config.model_dump()
         )
-
-        stats = engine.get_stats()
-        stats_path = exporter.export_statistics(stats)
         await manager.send_log(task_id, "info", "统计信息已保存")
 
-        if invalid_samples:
-            invalid_path = exporter.export_invalid_samples(invalid_samples)
+        if artifacts["invalid_samples"]:
             await manager.send_log(task_id, "info", f"无效样本已保存: {len(invalid_samples)} 个")
 
         # 完成任务
-        output_files = file_paths + [dataset_info_path, stats_path]
+        output_files = file_paths + [artifacts["dataset_info"], artifacts["statistics"]]
         await task_manager.complete_task(task_id, output_files, stats)
 
         await manager.send_log(task_id, "success", "任务完成！")
@@ -230,6 +303,10 @@ async def run_generation_task(task_id: str, config: GenerationConfig):
         logger.error(f"任务执行失败: {str(e)}", exc_info=True)
         await task_manager.fail_task(task_id, str(e))
         await manager.send_log(task_id, "error", f"任务失败: {str(e)}")
+    finally:
+        # 释放LLM客户端的HTTP连接池
+        if llm_client:
+            await llm_client.aclose()
 
 
 @app.get("/")
@@ -248,15 +325,27 @@ async def health_check():
     return {"status": "healthy"}
 
 
+def _log_task_exception(task: asyncio.Task) -> None:
+    """记录后台任务未捕获的异常，避免静默丢失"""
+    if task.cancelled():
+        return
+    exc = task.exception()
+    if exc:
+        logger.error(f"后台任务异常退出: {str(exc)}", exc_info=exc)
+
+
 @app.post("/api/generate/start", response_model=TaskCreateResponse)
-async def start_generation(config: GenerationConfig, background_tasks: BackgroundTasks):
+async def start_generation(config: GenerationConfig):
     """启动生成任务"""
     try:
         # 创建任务
-        task_id = task_manager.create_task(config.dict())
+        task_id = task_manager.create_task(config.model_dump())
 
-        # 后台运行
-        background_tasks.add_task(run_generation_task, task_id, config)
+        # 长时间运行的生成任务用独立asyncio任务承载，不绑定请求生命周期，
+        # 并注册到task_manager以支持取消
+        task_obj = asyncio.create_task(run_generation_task(task_id, config))
+        task_obj.add_done_callback(_log_task_exception)
+        task_manager.register_running_task(task_id, task_obj)
 
         return TaskCreateResponse(
             task_id=task_id,
@@ -323,31 +412,44 @@ async def download_dataset(task_id: str):
             filename=Path(file_path).name
         )
 
-    # 如果有多个文件，打包成ZIP
+    # 如果有多个文件，流式打包成ZIP边压缩边返回
+    # 避免先在磁盘上生成完整压缩包（双倍磁盘I/O + 客户端等待全部写完）
     import zipfile
     import tempfile
+    from fastapi.responses import StreamingResponse
 
-    # 创建临时ZIP文件
-    temp_zip = tempfile.NamedTemporaryFile(delete=False, suffix=".zip")
-    temp_zip_path = temp_zip.name
-    temp_zip.close()
+    def zip_stream(chunk_size: int = 1024 * 1024):
+        flushed = 0
 
-    try:
-        with zipfile.ZipFile(temp_zip_path, 'w', zipfile.ZIP_DEFLATED) as zipf:
-            for file_path in jsonl_files:
-                if Path(file_path).exists():
+        with tempfile.SpooledTemporaryFile(max_size=16 * chunk_size) as buffer:
+            with zipfile.ZipFile(buffer, 'w', zipfile.ZIP_DEFLATED) as zipf:
+                for file_path in jsonl_files:
+                    if not Path(file_path).exists():
+                        continue
                     zipf.write(file_path, Path(file_path).name)
 
-        return FileResponse(
-            temp_zip_path,
-            media_type="application/zip",
-            filename=f"dataset_{task_id[:8]}.zip"
-        )
-    except Exception as e:
-        # 清理临时文件
-        if Path(temp_zip_path).exists():
-            Path(temp_zip_path).unlink()
-        raise HTTPException(status_code=500, detail=f"打包失败: {str(e)}")
+                    # 每压缩完一个文件，把已生成的数据段发给客户端
+                    end = buffer.tell()
+                    buffer.seek(flushed)
+                    while flushed < end:
+                        chunk = buffer.read(min(chunk_size, end - flushed))
+                        flushed += len(chunk)
+                        yield chunk
+                    buffer.seek(end)
+
+            # ZipFile关闭时写入中央目录，补发剩余数据
+            end = buffer.tell()
+            buffer.seek(flushed)
+            while flushed < end:
+                chunk = buffer.read(min(chunk_size, end - flushed))
+                flushed += len(chunk)
+                yield chunk
+
+    return StreamingResponse(
+        zip_stream(),
+        media_type="application/zip",
+        headers={"Content-Disposition": f'attachment; filename="dataset_{task_id[:8]}.zip"'}
+    )
 
 
 @app.websocket("/api/logs/{task_id}")
@@ -356,15 +458,17 @@ async def websocket_logs(websocket: WebSocket, task_id: str):
     await manager.connect(task_id, websocket)
 
     try:
-        while True:
-            # 保持连接
-            await websocket.receive_text()
+        # 前端不会主动发送业务消息，这里只消费保活帧
+        # async for由框架统一处理断开，比逐条receive_text更轻
+        async for _ in websocket.iter_text():
+            pass
 
     except WebSocketDisconnect:
-        manager.disconnect(task_id)
+        pass
     except Exception as e:
         logger.error(f"WebSocket错误: {str(e)}")
-        manager.disconnect(task_id)
+    finally:
+        manager.disconnect(task_id, websocket)
 
 
 @app.get("/api/tasks")
@@ -446,10 +550,14 @@ async def preview_tools(path: str = "configs/tools_registry.json"):
 if __name__ == "__main__":
     import uvicorn
 
+    # uvloop + httptools：C实现的事件循环和HTTP解析器
+    # 注意：reload模式会强制使用标准库事件循环，生产环境保持关闭
     uvicorn.run(
         "app:app",
         host="0.0.0.0",
         port=8000,
-        reload=True,
+        loop="uvloop",
+        http="httptools",
+        reload=False,
         log_level="info"
     )
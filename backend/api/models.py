@@ -2,7 +2,7 @@
 API数据模型
 """
 
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, ConfigDict, Field
 from typing import Optional, List, Dict
 from enum import Enum
 
@@ -14,7 +14,9 @@ class ToolCountMode(str, Enum):
 
 
 class GenerationConfig(BaseModel):
-    """生成配置"""
+    """生成配置（冻结：任务启动后配置不可变，可安全地在协程间共享）"""
+    model_config = ConfigDict(frozen=True)
+
     num_samples: int = Field(default=1000, ge=1, le=100000, description="生成样本数量")
     multi_ratio: float = Field(default=0.3, ge=0.0, le=1.0, description="多轮对话比例")
     tool_count: int = Field(default=3, ge=1, le=20, description="工具数量")
@@ -4,7 +4,12 @@
 """
 
 import asyncio
+import hashlib
+import json
+import os
 import time
+from collections import deque
+from pathlib import Path
 from typing import Dict, List, Optional, Callable
 from dataclasses import dataclass, field
 from .task_generator import Task
@@ -12,6 +17,9 @@ from .data_synthesizer import DataSynthesizer
 from .validator import Validator
 from .utils import setup_logger
 
+# 断点文件每写入多少个样本做一次fsync（逐样本fsync开销太大）
+_CHECKPOINT_SYNC_EVERY = 50
+
 
 @dataclass
 class ProgressStats:
@@ -25,6 +33,9 @@ class ProgressStats:
     validation_failed: int = 0
     start_time: float = field(default_factory=time.time)
     errors: List[str] = field(default_factory=list)
+    # to_dict的记忆化缓存（计数字段未变化时复用上次结果）
+    _cache_key: Optional[tuple] = field(default=None, repr=False)
+    _cached_dict: Optional[Dict] = field(default=None, repr=False)
 
     @property
     def progress_percent(self) -> float:
@@ -50,8 +61,22 @@ class ProgressStats:
         return (self.validation_success / total_validated) * 100
 
     def to_dict(self) -> Dict:
-        """转换为字典"""
-        return {
+        """转换为字典（计数未变化时直接返回缓存结果，省掉派生值和round的重复计算）"""
+        key = (
+            self.total_tasks,
+            self.completed_tasks,
+            self.failed_tasks,
+            self.single_turn_count,
+            self.multi_turn_count,
+            self.validation_success,
+            self.validation_failed,
+            len(self.errors)
+        )
+
+        if key == self._cache_key:
+            return self._cached_dict
+
+        result = {
             "total": self.total_tasks,
             "completed_count": self.completed_tasks,
             "failed_count": self.failed_tasks,
@@ -63,10 +88,17 @@ class ProgressStats:
             "errors": self.errors[-10:]  # 只保留最近10条错误
         }
 
+        self._cache_key = key
+        self._cached_dict = result
+        return result
+
 
 class ConcurrentEngine:
     """并发执行引擎"""
 
+    # 进度回调的最小触发间隔（秒），避免每个任务完成都触发一次回调
+    PROGRESS_FLUSH_INTERVAL = 0.1
+
     def __init__(
         self,
         synthesizer: DataSynthesizer,
@@ -86,22 +118,34 @@ class ConcurrentEngine:
         self.concurrency = concurrency
         self.stats = ProgressStats()
         self.logger = setup_logger("ConcurrentEngine")
-        self._progress_callbacks: List[Callable] = []
-        self._log_callbacks: List[Callable] = []
+        # 回调在注册时按同步/异步分类，避免热路径上反复做iscoroutinefunction检查
+        self._sync_progress_callbacks: List[Callable] = []
+        self._async_progress_callbacks: List[Callable] = []
+        self._sync_log_callbacks: List[Callable] = []
+        self._async_log_callbacks: List[Callable] = []
+        self._progress_dirty = asyncio.Event()
 
     def add_progress_callback(self, callback: Callable[[ProgressStats], None]) -> None:
         """添加进度回调函数"""
-        self._progress_callbacks.append(callback)
+        if asyncio.iscoroutinefunction(callback):
+            self._async_progress_callbacks.append(callback)
+        else:
+            self._sync_progress_callbacks.append(callback)
 
     def add_log_callback(self, callback: Callable[[str], None]) -> None:
         """添加日志回调函数"""
-        self._log_callbacks.append(callback)
+        if asyncio.iscoroutinefunction(callback):
+            self._async_log_callbacks.append(callback)
+        else:
+            self._sync_log_callbacks.append(callback)
 
     async def process_tasks(
         self,
         tasks: List[Task],
         enable_validation: bool = True,
-        enable_correction: bool = False
+        enable_correction: bool = False,
+        sample_writer: Optional[Callable] = None,
+        checkpoint_file: Optional[str] = None
     ) -> tuple[List[Dict], List[Dict]]:
         """
         并发处理任务列表
@@ -110,73 +154,223 @@ class ConcurrentEngine:
             tasks: 任务列表
             enable_validation: 是否启用验证
             enable_correction: 是否启用自动修正
+            sample_writer: 可选的异步写入回调，样本生成后立即落盘
+                （适合不需要批量验证的调用方，避免全量样本驻留内存）
+            checkpoint_file: 可选的断点文件路径：每个完成样本追加一行，
+                重启时按任务内容哈希跳过已完成的任务，长任务崩溃后
+                不必从零重跑（任务ID含时间戳，跨进程不稳定，故用内容哈希）
 
         Returns:
             (有效样本列表, 无效样本列表)
         """
+        total_tasks = len(tasks)
+
         # 只在第一次调用时初始化stats，避免重置累积的validation计数
         if self.stats.total_tasks == 0:
-            self.stats = ProgressStats(total_tasks=len(tasks))
+            self.stats = ProgressStats(total_tasks=total_tasks)
         else:
             # 更新total_tasks但保留validation计数
-            self.stats.total_tasks = len(tasks)
-
-        self.logger.info(f"开始并发处理 {len(tasks)} 个任务，并发度={self.concurrency}")
-        await self._notify_log(f"开始并发处理 {len(tasks)} 个任务，并发度={self.concurrency}")
-
-        # 创建信号量控制并发
-        semaphore = asyncio.Semaphore(self.concurrency)
+            self.stats.total_tasks = total_tasks
+
+        self.logger.info(f"开始并发处理 {total_tasks} 个任务，并发度={self.concurrency}")
+        await self._notify_log(f"开始并发处理 {total_tasks} 个任务，并发度={self.concurrency}")
+
+        # 转入deque后释放对原列表的引用，任务投递出去后即可被逐个回收
+        pending = deque(tasks)
+        tasks = None
+        valid_samples_list: List[Dict] = []
+
+        # 断点恢复：跳过上次运行已完成的任务，直接复用其样本
+        ckpt_fp = None
+        ckpt_pending_sync = 0
+        if checkpoint_file is not None:
+            done = self._load_checkpoint(checkpoint_file)
+            if done:
+                remaining: deque = deque()
+                for task in pending:
+                    sample = done.get(self._task_key(task))
+                    if sample is None:
+                        remaining.append(task)
+                        continue
+                    valid_samples_list.append(sample)
+                    self.stats.completed_tasks += 1
+                    if task.task_type == "single":
+                        self.stats.single_turn_count += 1
+                    else:
+                        self.stats.multi_turn_count += 1
+                reused = len(pending) - len(remaining)
+                if reused:
+                    self.logger.info(f"断点恢复：复用 {reused} 个已完成样本，剩余 {len(remaining)} 个任务")
+                    await self._notify_log(f"断点恢复：复用 {reused} 个已完成样本")
+                pending = remaining
+
+            Path(checkpoint_file).parent.mkdir(parents=True, exist_ok=True)
+            ckpt_fp = open(checkpoint_file, "a", encoding="utf-8")
+
+        def checkpoint_sample(task: Task, sample: Dict) -> None:
+            nonlocal ckpt_pending_sync
+            record = dict(sample)
+            record["_ckpt_key"] = self._task_key(task)
+            ckpt_fp.write(json.dumps(record, ensure_ascii=False, default=str) + "\n")
+            ckpt_pending_sync += 1
+            if ckpt_pending_sync >= _CHECKPOINT_SYNC_EVERY:
+                ckpt_pending_sync = 0
+                ckpt_fp.flush()
+                os.fsync(ckpt_fp.fileno())
+
+        # 启动进度刷新协程：合并高频进度事件，按固定间隔批量通知
+        flusher = asyncio.create_task(self._flush_progress_loop())
+
+        # 有界队列 + 固定worker池：存活协程数为O(concurrency)而非O(N)
+        queue: asyncio.Queue = asyncio.Queue(maxsize=self.concurrency * 2)
+
+        async def worker() -> None:
+            while True:
+                task = await queue.get()
+                try:
+                    if task is None:
+                        return
+                    sample = await self._process_single_task(task)
+                    if sample is not None:
+                        valid_samples_list.append(sample)
+                        # 落盘失败（如磁盘写满）不能让worker死亡：worker一死，
+                        # 生产者会在有界队列的put上永久阻塞，整个run就此卡死。
+                        # 样本已在内存中，记录错误后继续消费即可
+                        try:
+                            if ckpt_fp is not None:
+                                checkpoint_sample(task, sample)
+                            if sample_writer is not None:
+                                await sample_writer(sample)
+                        except Exception as e:
+                            self.logger.error(f"样本落盘失败 [{task.task_id}]: {str(e)}")
+                            self.stats.errors.append(f"{task.task_id}: 落盘失败 {str(e)}")
+                finally:
+                    queue.task_done()
+
+        workers = [asyncio.create_task(worker()) for _ in range(self.concurrency)]
 
-        # 创建worker任务
-        async def worker(task: Task) -> Optional[Dict]:
-            async with semaphore:
-                return await self._process_single_task(task)
-
-        # 并发执行
-        worker_tasks = [worker(task) for task in tasks]
-        samples = await asyncio.gather(*worker_tasks, return_exceptions=True)
-
-        # 过滤异常和None
-        valid_samples_list = []
-        for sample in samples:
-            if isinstance(sample, Exception):
-                self.logger.error(f"任务执行异常: {str(sample)}")
-                self.stats.failed_tasks += 1
-            elif sample is not None:
-                valid_samples_list.append(sample)
+        try:
+            # 生产者：逐个投递任务，队列满时自动反压
+            while pending:
+                await queue.put(pending.popleft())
+
+            # 发送结束哨兵并等待所有worker退出
+            for _ in workers:
+                await queue.put(None)
+            await asyncio.gather(*workers)
+        finally:
+            flusher.cancel()
+            # 取消或异常退出时worker还活着（等queue.get或处理在途任务），
+            # 必须显式取消并等它们真正结束，否则每次取消的run都会泄漏
+            # 整个worker池；等完再关断点文件，避免worker写已关闭的句柄
+            for w in workers:
+                w.cancel()
+            await asyncio.gather(*workers, return_exceptions=True)
+            if ckpt_fp is not None:
+                ckpt_fp.close()
+
+        # 最终刷新一次，确保回调收到最新状态
+        await self._dispatch_progress()
 
         # 验证
         if enable_validation:
             self.logger.info("开始验证样本...")
             await self._notify_log(f"开始验证 {len(valid_samples_list)} 个样本...")
 
-            valid_samples, invalid_samples = self.validator.validate_batch(valid_samples_list)
+            # 同步验证放到工作线程，避免大批量时阻塞事件循环（WS推送、进度回调）
+            valid_samples, invalid_samples = await asyncio.to_thread(
+                self.validator.validate_batch, valid_samples_list
+            )
 
             self.stats.validation_success += len(valid_samples)
             self.stats.validation_failed += len(invalid_samples)
 
             # 验证完成后立即触发回调，更新前端显示
             await self._notify_log(f"验证完成: 有效={len(valid_samples)}, 无效={len(invalid_samples)}")
-            self._notify_progress()
+            await self._dispatch_progress()
 
-            # 尝试修正无效样本
+            # 尝试修正无效样本（并发执行，用信号量限流）
             if enable_correction and invalid_samples:
                 self.logger.info(f"尝试修正 {len(invalid_samples)} 个无效样本...")
+                semaphore = asyncio.Semaphore(self.concurrency)
+
+                async def correct_one(sample: Dict) -> Optional[Dict]:
+                    async with semaphore:
+                        return await asyncio.to_thread(self.validator.auto_correct, sample)
+
+                corrected_results = await asyncio.gather(
+                    *(correct_one(s) for s in invalid_samples),
+                    return_exceptions=True
+                )
+
+                # 单次遍历拆分出修正成功和仍然无效的样本
                 corrected_samples = []
-                for sample in invalid_samples:
-                    corrected = self.validator.auto_correct(sample)
-                    if corrected:
+                still_invalid = []
+                for sample, corrected in zip(invalid_samples, corrected_results):
+                    if isinstance(corrected, Exception):
+                        self.logger.error(f"样本修正异常: {str(corrected)}")
+                        still_invalid.append(sample)
+                    elif corrected:
                         corrected_samples.append(corrected)
+                    else:
+                        still_invalid.append(sample)
 
                 self.logger.info(f"成功修正 {len(corrected_samples)} 个样本")
                 valid_samples.extend(corrected_samples)
-                invalid_samples = [s for s in invalid_samples if s not in corrected_samples]
+                invalid_samples = still_invalid
 
             self.logger.info(f"验证完成：有效 {len(valid_samples)}, 无效 {len(invalid_samples)}")
             return valid_samples, invalid_samples
 
         return valid_samples_list, []
 
+    @staticmethod
+    def _task_key(task: Task) -> str:
+        """任务输入的内容哈希（固定seed下跨进程可复现，用作断点键）"""
+        task_dict = task.to_dict()
+        payload = json.dumps(
+            {
+                "type": task.task_type,
+                "system": task_dict["system"],
+                "tools": task_dict["tools"],
+                "query": task.user_query
+            },
+            sort_keys=True,
+            ensure_ascii=False
+        )
+        return hashlib.blake2b(payload.encode("utf-8"), digest_size=16).hexdigest()
+
+    def _load_checkpoint(self, checkpoint_file: str) -> Dict[str, Dict]:
+        """加载断点文件，返回内容哈希到已完成样本的映射
+
+        逐行解析并跳过坏行：断点文件恰恰是进程崩溃时留下的，缓冲写入
+        加按批fsync意味着最后一行很可能被截断，坏行只当对应样本未完成
+        重跑即可，不能让恢复流程本身因此抛错。
+        """
+        try:
+            with open(checkpoint_file, "rb") as f:
+                lines = f.readlines()
+        except FileNotFoundError:
+            return {}
+
+        done: Dict[str, Dict] = {}
+        dropped = 0
+        for line in lines:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                dropped += 1
+                continue
+            key = record.pop("_ckpt_key", None) if isinstance(record, dict) else None
+            if key:
+                done[key] = record
+        if dropped:
+            self.logger.warning(f"断点文件中 {dropped} 行无法解析（多为崩溃时的截断写入），已跳过")
+        return done
+
     async def _process_single_task(self, task: Task) -> Optional[Dict]:
         """
         处理单个任务
@@ -216,21 +410,51 @@ class ConcurrentEngine:
             return None
 
     def _notify_progress(self) -> None:
-        """通知进度更新"""
-        for callback in self._progress_callbacks:
+        """标记进度已更新（由刷新协程按间隔批量通知）"""
+        # 无监听者时直接返回（CLI/测试场景），不触发刷新链路
+        if not (self._sync_progress_callbacks or self._async_progress_callbacks):
+            return
+        self._progress_dirty.set()
+
+    async def _flush_progress_loop(self) -> None:
+        """进度刷新循环：合并密集的进度事件，每个间隔最多通知一次"""
+        try:
+            while True:
+                await self._progress_dirty.wait()
+                self._progress_dirty.clear()
+                await self._dispatch_progress()
+                await asyncio.sleep(self.PROGRESS_FLUSH_INTERVAL)
+        except asyncio.CancelledError:
+            pass
+
+    async def _dispatch_progress(self) -> None:
+        """执行进度回调（支持同步和异步回调）"""
+        for callback in self._sync_progress_callbacks:
             try:
                 callback(self.stats)
             except Exception as e:
                 self.logger.error(f"进度回调执行失败: {str(e)}")
 
+        for callback in self._async_progress_callbacks:
+            try:
+                await callback(self.stats)
+            except Exception as e:
+                self.logger.error(f"进度回调执行失败: {str(e)}")
+
     async def _notify_log(self, message: str) -> None:
         """通知日志更新"""
-        for callback in self._log_callbacks:
+        if not (self._sync_log_callbacks or self._async_log_callbacks):
+            return
+
+        for callback in self._sync_log_callbacks:
             try:
-                if asyncio.iscoroutinefunction(callback):
-                    await callback(message)
-                else:
-                    callback(message)
+                callback(message)
+            except Exception as e:
+                self.logger.error(f"日志回调执行失败: {str(e)}")
+
+        for callback in self._async_log_callbacks:
+            try:
+                await callback(message)
             except Exception as e:
                 self.logger.error(f"日志回调执行失败: {str(e)}")
 
@@ -3,11 +3,80 @@
 负责将验证通过的样本导出为指定格式
 """
 
+import asyncio
+import gzip
 import json
+import logging
+import os
+import msgspec
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-from typing import Dict, List, Optional
+from typing import BinaryIO, Dict, List, Optional, TextIO
 from datetime import datetime
-from .utils import setup_logger, save_jsonl, save_json, ensure_dir, chunks
+from .utils import setup_logger, save_jsonl, save_json, ensure_dir
+
+# 字节转MB的乘数（避免热循环里重复做除法）
+_INV_MB = 1 / (1024 * 1024)
+
+
+class DPOSample(msgspec.Struct):
+    """导出行的固定schema（msgspec在C层按字段顺序编码，无逐键introspection）"""
+    system: str = ""
+    tools: str = ""
+    messages: list = []
+    chosen: str = ""
+    rejected: str = ""
+
+
+# 预构建的JSONL编码器（encode_lines一次性输出整个分片的换行分隔JSON）
+_JSONL_ENCODER = msgspec.json.Encoder()
+
+
+class AsyncJsonlWriter:
+    """流式JSONL写入器
+
+    边生成边落盘，避免整个数据集驻留内存。
+    用法：
+        async with exporter.async_writer("data_dpo.jsonl") as writer:
+            await writer.write(sample)
+    """
+
+    def __init__(self, file_path: str, logger: logging.Logger):
+        self.file_path = file_path
+        self.logger = logger
+        self.sample_count = 0
+        self._file: Optional[TextIO] = None
+
+    async def __aenter__(self) -> "AsyncJsonlWriter":
+        Path(self.file_path).parent.mkdir(parents=True, exist_ok=True)
+        self._file = open(self.file_path, 'w', encoding='utf-8')
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb) -> None:
+        self._file.close()
+        self._file = None
+        self.logger.info(f"流式导出完成: {self.file_path} (共{self.sample_count}条)")
+
+    async def write(self, sample: Dict) -> None:
+        """写入单个样本（文件写入放到工作线程，不阻塞事件循环）"""
+        formatted = {
+            "system": sample.get("system", ""),
+            "tools": _tools_as_json(sample),
+            "messages": sample.get("messages", []),
+            "chosen": sample.get("chosen", ""),
+            "rejected": sample.get("rejected", "")
+        }
+        line = json.dumps(formatted, ensure_ascii=False) + '\n'
+        await asyncio.to_thread(self._file.write, line)
+        self.sample_count += 1
+
+
+def _tools_as_json(sample: Dict) -> str:
+    """取样本tools字段的JSON串形式（流水线内部允许保留list，导出时才序列化）"""
+    tools = sample.get("tools", "")
+    if isinstance(tools, str):
+        return tools
+    return json.dumps(tools, ensure_ascii=False)
 
 
 class Exporter:
@@ -22,59 +91,123 @@ class Exporter:
         """
         self.output_dir = output_dir
         self.logger = setup_logger("Exporter")
+        # 写入时记录的各文件行数，避免摘要阶段重读整个数据集
+        self._shard_line_counts: Dict[str, int] = {}
         ensure_dir(output_dir)
 
+    def async_writer(self, filename: str = "data_dpo.jsonl") -> AsyncJsonlWriter:
+        """
+        创建流式JSONL写入器
+
+        Args:
+            filename: 文件名
+
+        Returns:
+            异步写入器（async context manager）
+        """
+        file_path = Path(self.output_dir) / filename
+        return AsyncJsonlWriter(str(file_path), self.logger)
+
+    def _write_shard(self, file_path: str, shard: List[Dict], compress: bool) -> int:
+        """写入单个分片文件，返回写入行数"""
+        records = [
+            DPOSample(
+                system=sample.get("system", ""),
+                tools=_tools_as_json(sample),
+                messages=sample.get("messages", []),
+                chosen=sample.get("chosen", ""),
+                rejected=sample.get("rejected", "")
+            )
+            for sample in shard
+        ]
+
+        file_handle: BinaryIO
+        if compress:
+            file_handle = gzip.open(file_path, 'wb', compresslevel=5)
+        else:
+            file_handle = open(file_path, 'wb', buffering=1 << 20)
+
+        try:
+            file_handle.write(_JSONL_ENCODER.encode_lines(records))
+
+            # 分片写完即逐出页缓存：导出数据写一次、极少回读，
+            # 留在页缓存里只会挤占生成协程的内存（仅Linux等支持fadvise的平台）
+            if hasattr(os, "posix_fadvise"):
+                try:
+                    file_handle.flush()
+                    fd = file_handle.fileno()
+                    os.fsync(fd)
+                    os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_DONTNEED)
+                except (OSError, ValueError):
+                    pass
+        finally:
+            file_handle.close()
+
+        self._shard_line_counts[file_path] = len(shard)
+        self.logger.info(f"已导出 {len(shard)} 条样本到: {file_path}")
+        return len(shard)
+
     def export_to_jsonl(
         self,
-        samples: List[Dict],
+        samples,
         filename: str = "data_dpo.jsonl",
-        batch_size: int = 1000
+        batch_size: int = 1000,
+        compress: bool = False
     ) -> List[str]:
         """
-        导出为JSONL格式
+        导出为JSONL格式（分片并行写入）
+
+        逐条消费样本，每满batch_size行组成一个分片，交给线程池异步落盘，
+        多个分片的磁盘I/O相互重叠；内存中最多只保留一个正在累积的分片。
+        支持任意可迭代的样本来源。
 
         Args:
-            samples: 样本列表
+            samples: 样本可迭代对象
             filename: 文件名
             batch_size: 每个文件的样本数量
+            compress: 是否gzip压缩（输出.jsonl.gz）
 
         Returns:
             生成的文件路径列表
         """
-        if not samples:
+        suffix = ".gz" if compress else ""
+        file_paths: List[str] = []
+        futures = []
+        shard: List[Dict] = []
+        file_index = 0
+
+        def submit_shard():
+            nonlocal shard, file_index
+            file_index += 1
+            base_name = filename.replace(".jsonl", f"_{file_index:05d}.jsonl") + suffix
+            file_path = str(Path(self.output_dir) / base_name)
+            file_paths.append(file_path)
+            futures.append(executor.submit(self._write_shard, file_path, shard, compress))
+            shard = []
+
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            for sample in samples:
+                shard.append(sample)
+                if len(shard) >= batch_size:
+                    submit_shard()
+
+            if shard:
+                submit_shard()
+
+            # 等待所有分片写完，传播写入异常
+            for future in futures:
+                future.result()
+
+        if not file_paths:
             self.logger.warning("没有样本可导出")
             return []
 
-        # 分批
-        batches = chunks(samples, batch_size)
-        file_paths = []
-
-        for i, batch in enumerate(batches, 1):
-            # 生成文件名
-            if len(batches) > 1:
-                base_name = filename.replace(".jsonl", f"_{i:05d}.jsonl")
-            else:
-                base_name = filename
-
-            file_path = Path(self.output_dir) / base_name
-
-            # 过滤并格式化样本
-            formatted_samples = []
-            for sample in batch:
-                formatted = {
-                    "system": sample.get("system", ""),
-                    "tools": sample.get("tools", ""),
-                    "messages": sample.get("messages", []),
-                    "chosen": sample.get("chosen", ""),
-                    "rejected": sample.get("rejected", "")
-                }
-                formatted_samples.append(formatted)
-
-            # 保存
-            save_jsonl(formatted_samples, str(file_path))
-            file_paths.append(str(file_path))
-
-            self.logger.info(f"已导出 {len(batch)} 条样本到: {file_path}")
+        # 只有一个文件时保持原始文件名（与分片命名区分）
+        if len(file_paths) == 1:
+            final_path = str(Path(self.output_dir) / (filename + suffix))
+            Path(file_paths[0]).rename(final_path)
+            self._shard_line_counts[final_path] = self._shard_line_counts.pop(file_paths[0])
+            file_paths[0] = final_path
 
         return file_paths
 
@@ -167,6 +300,46 @@ class Exporter:
         self.logger.info(f"无效样本已导出: {file_path} (共{len(invalid_samples)}条)")
         return str(file_path)
 
+    def export_run_artifacts(
+        self,
+        stats: Dict,
+        invalid_samples: List[Dict],
+        dataset_name: str = "tool_dpo_dataset",
+        file_name: str = "data_dpo.jsonl",
+        config: Optional[Dict] = None
+    ) -> Dict[str, str]:
+        """
+        一次性导出运行收尾的三个产物（dataset_info、统计、无效样本）
+
+        三个小文件互不依赖，扔进同一个线程池并行落盘，收尾阶段只
+        等待一次而不是串行三次写文件。
+
+        Args:
+            stats: 统计数据
+            invalid_samples: 无效样本列表（为空则跳过）
+            dataset_name: 数据集名称
+            file_name: 数据文件名（写入dataset_info）
+            config: 生成配置（可选）
+
+        Returns:
+            {"dataset_info": 路径, "statistics": 路径, "invalid_samples": 路径或空串}
+        """
+        with ThreadPoolExecutor(max_workers=3) as executor:
+            info_future = executor.submit(
+                self.generate_dataset_info, dataset_name, file_name, config
+            )
+            stats_future = executor.submit(self.export_statistics, stats)
+            invalid_future = (
+                executor.submit(self.export_invalid_samples, invalid_samples)
+                if invalid_samples else None
+            )
+
+            return {
+                "dataset_info": info_future.result(),
+                "statistics": stats_future.result(),
+                "invalid_samples": invalid_future.result() if invalid_future else ""
+            }
+
     def create_batch_files(
         self,
         samples: List[Dict],
@@ -200,24 +373,32 @@ class Exporter:
         file_info = []
 
         for path in file_paths:
-            if Path(path).exists():
-                size = Path(path).stat().st_size
-                total_size += size
-
-                # 统计行数
-                with open(path, 'r', encoding='utf-8') as f:
-                    line_count = sum(1 for _ in f)
-
-                file_info.append({
-                    "path": path,
-                    "size_bytes": size,
-                    "size_mb": round(size / (1024 * 1024), 2),
-                    "line_count": line_count
-                })
+            # EAFP：一次stat同时完成存在性检查和取大小
+            try:
+                size = os.stat(path).st_size
+            except FileNotFoundError:
+                continue
+
+            total_size += size
+
+            # 优先使用写入时记录的行数，仅对非本实例导出的文件回退重数；
+            # 回退路径按后缀识别gzip分片，按文本打开会在魔数上抛解码错误
+            line_count = self._shard_line_counts.get(path)
+            if line_count is None:
+                opener = gzip.open if path.endswith('.gz') else open
+                with opener(path, 'rb') as f:
+                    line_count = sum(chunk.count(b'\n') for chunk in iter(lambda: f.read(1 << 20), b''))
+
+            file_info.append({
+                "path": path,
+                "size_bytes": size,
+                "size_mb": round(size * _INV_MB, 2),
+                "line_count": line_count
+            })
 
         return {
             "file_count": len(file_paths),
-            "total_size_mb": round(total_size / (1024 * 1024), 2),
+            "total_size_mb": round(total_size * _INV_MB, 2),
             "files": file_info
         }
 
@@ -3,16 +3,86 @@
 负责根据工具定义生成自然语言任务和上下文
 """
 
+import functools
 import random
 import json
-from typing import Dict, List, Optional, Tuple
+import string
+from typing import ClassVar, Dict, List, Optional, Sequence, Tuple
 from .tool_registry import Tool, ToolRegistry
 from .utils import setup_logger, generate_id
 
 
+def _compile_template(template: str):
+    """
+    把format模板预解析为渲染闭包
+
+    str.format每次调用都会重新解析{city}/{expr}等占位符；这里用
+    string.Formatter在导入时解析一次，渲染时只做字符串拼接。
+
+    Returns:
+        (render闭包, 模板引用的字段名frozenset)
+    """
+    segments = [(literal, field) for literal, field, _, _ in string.Formatter().parse(template)]
+    fields = frozenset(field for _, field in segments if field)
+
+    if not fields:
+        return (lambda **kwargs: template), fields
+
+    def render(**kwargs) -> str:
+        parts = []
+        for literal, field in segments:
+            if literal:
+                parts.append(literal)
+            if field:
+                parts.append(str(kwargs[field]))
+        return "".join(parts)
+
+    return render, fields
+
+
+class _BatchSampler:
+    """批量预抽样器
+
+    random.choice每次调用都要走一遍_randbelow和边界检查；这里按块用
+    random.choices一次抽够，调用方逐个消费，把每次抽样的解释器开销
+    摊到整个块上。按population的id缓存各自的缓冲区。
+    """
+
+    def __init__(self, block_size: int = 256):
+        self.block_size = block_size
+        self._buffers: Dict[int, list] = {}
+
+    def pick(self, population: Sequence):
+        """从population中抽取一个元素（等价于random.choice，但按块预抽）"""
+        key = id(population)
+        buffer = self._buffers.get(key)
+        if not buffer:
+            buffer = random.choices(population, k=self.block_size)
+            self._buffers[key] = buffer
+        return buffer.pop()
+
+    def reset(self) -> None:
+        """清空缓冲区（重新设置随机种子后调用，保证可复现）"""
+        self._buffers.clear()
+
+
+@functools.lru_cache(maxsize=512)
+def _tools_json(tools: Tuple[Tool, ...]) -> str:
+    """拼接工具子集的JSON数组串（按子集memo，抽到相同组合的任务共享一份）"""
+    return "[" + ", ".join(tool.to_json() for tool in tools) + "]"
+
+
 class Task:
     """任务定义类"""
 
+    # 固定属性布局：批量生成十万级任务时省掉每实例的__dict__开销。
+    # _multi_turn_context/_last_user_query由数据合成器在多轮场景下挂载
+    __slots__ = (
+        "task_id", "task_type", "tools", "user_query", "system_prompt",
+        "expected_tool_sequence", "_cached_dict",
+        "_multi_turn_context", "_last_user_query",
+    )
+
     def __init__(
         self,
         task_id: str,
@@ -28,17 +98,22 @@ class Task:
         self.user_query = user_query
         self.system_prompt = system_prompt
         self.expected_tool_sequence = expected_tool_sequence or []
+        # to_dict结果缓存（任务创建后字段不再变化）
+        self._cached_dict: Optional[Dict] = None
 
     def to_dict(self) -> Dict:
-        """转换为字典格式"""
-        return {
-            "task_id": self.task_id,
-            "task_type": self.task_type,
-            "system": self.system_prompt,
-            "tools": json.dumps([tool.to_dict() for tool in self.tools], ensure_ascii=False),
-            "messages": [{"role": "user", "content": self.user_query}],
-            "expected_tool_sequence": self.expected_tool_sequence
-        }
+        """转换为字典格式（结果缓存，tools只JSON序列化一次）"""
+        if self._cached_dict is None:
+            self._cached_dict = {
+                "task_id": self.task_id,
+                "task_type": self.task_type,
+                "system": self.system_prompt,
+                # 逐工具的JSON片段已缓存，相同工具组合的拼接结果也按子集共享
+                "tools": _tools_json(tuple(self.tools)),
+                "messages": [{"role": "user", "content": self.user_query}],
+                "expected_tool_sequence": self.expected_tool_sequence
+            }
+        return self._cached_dict
 
     def __repr__(self) -> str:
         return f"Task(id={self.task_id}, type={self.task_type}, tools={len(self.tools)})"
@@ -69,9 +144,9 @@ class TaskGenerator:
 
 请确保你的工具调用是准确的，参数是完整的。"""
 
-    # 任务模板（按工具类型分类，增加多样性）
-    TASK_TEMPLATES = {
-        "天气查询": [
+    # 任务模板（按工具类型分类，增加多样性；元组冻结，类加载后只读）
+    TASK_TEMPLATES: ClassVar[Dict[str, tuple]] = {
+        "天气查询": (
             "请帮我查询{city}的天气情况",
             "{city}今天天气怎么样？",
             "我想知道{city}最近的天气预报",
@@ -84,8 +159,8 @@ class TaskGenerator:
             "{city}现在是什么天气",
             "今天{city}的空气质量怎么样",
             "{city}的温度和湿度是多少"
-        ],
-        "时间查询": [
+        ),
+        "时间查询": (
             "现在几点了？",
             "请告诉我当前时间",
             "帮我看一下现在的时间",
@@ -96,8 +171,8 @@ class TaskGenerator:
             "什么时候了",
             "现在的北京时间",
             "时间多少了"
-        ],
-        "计算": [
+        ),
+        "计算": (
             "帮我计算{expr}",
             "{expr}等于多少？",
             "请计算这个表达式：{expr}",
@@ -108,8 +183,8 @@ class TaskGenerator:
             "{expr}怎么算",
             "帮我算算{expr}是多少",
             "我想知道{expr}的答案"
-        ],
-        "搜索": [
+        ),
+        "搜索": (
             "帮我搜索关于{query}的信息",
             "我想了解一下{query}",
             "请搜索{query}相关内容",
@@ -122,8 +197,8 @@ class TaskGenerator:
             "搜索{query}相关的文章",
             "{query}有什么特点",
             "告诉我{query}的背景"
-        ],
-        "翻译": [
+        ),
+        "翻译": (
             "请把'{text}'翻译成{target_lang}",
             "帮我翻译：{text}，目标语言是{target_lang}",
             "这句话用{target_lang}怎么说：{text}",
@@ -134,8 +209,8 @@ class TaskGenerator:
             "把{text}转换成{target_lang}",
             "{text}用{target_lang}如何表达",
             "请将{text}译为{target_lang}"
-        ],
-        "货币转换": [
+        ),
+        "货币转换": (
             "把{amount}{from_currency}转换成{to_currency}",
             "{amount}{from_currency}等于多少{to_currency}",
             "我想知道{amount}{from_currency}的{to_currency}价值",
@@ -143,8 +218,8 @@ class TaskGenerator:
             "{from_currency}兑{to_currency}汇率是多少",
             "{amount}{from_currency}能换多少{to_currency}",
             "转换{amount}{from_currency}为{to_currency}"
-        ],
-        "新闻获取": [
+        ),
+        "新闻获取": (
             "给我看看{category}类的新闻",
             "最近有什么{category}新闻",
             "我想看{category}方面的资讯",
@@ -152,8 +227,8 @@ class TaskGenerator:
             "{category}领域有什么新动态",
             "查看{category}新闻头条",
             "今天的{category}新闻有哪些"
-        ],
-        "通用": [
+        ),
+        "通用": (
             "请使用合适的工具帮我完成这个任务",
             "我需要你的帮助来解决这个问题",
             "请调用相关工具来处理这个请求",
@@ -162,29 +237,29 @@ class TaskGenerator:
             "需要调用什么工具",
             "这个问题怎么处理",
             "请使用{tool_name}工具"
-        ]
+        )
     }
 
-    # 扩展的参数池，增加多样性
-    PARAMS = {
-        "cities": ["北京", "上海", "广州", "深圳", "杭州", "成都", "西安", "武汉", "南京", "重庆",
-                   "天津", "苏州", "长沙", "青岛", "大连", "厦门", "宁波", "济南", "哈尔滨", "郑州"],
-        "expressions": ["1+1", "25*4", "100/5", "2^10", "sqrt(144)", "15-8", "36/6", "7*8",
-                       "1000-567", "45+78", "99/3", "12*12", "(10+5)*2", "50%3", "2^8"],
-        "search_queries": ["人工智能", "机器学习", "深度学习", "自然语言处理", "大模型", "ChatGPT",
+    # 扩展的参数池，增加多样性（元组冻结）
+    PARAMS: ClassVar[Dict[str, tuple]] = {
+        "cities": ("北京", "上海", "广州", "深圳", "杭州", "成都", "西安", "武汉", "南京", "重庆",
+                   "天津", "苏州", "长沙", "青岛", "大连", "厦门", "宁波", "济南", "哈尔滨", "郑州"),
+        "expressions": ("1+1", "25*4", "100/5", "2^10", "sqrt(144)", "15-8", "36/6", "7*8",
+                       "1000-567", "45+78", "99/3", "12*12", "(10+5)*2", "50%3", "2^8"),
+        "search_queries": ("人工智能", "机器学习", "深度学习", "自然语言处理", "大模型", "ChatGPT",
                           "Python编程", "数据科学", "云计算", "区块链", "物联网", "5G技术",
-                          "量子计算", "元宇宙", "Web3", "神经网络", "计算机视觉", "语音识别"],
-        "texts": ["你好", "谢谢", "再见", "早上好", "晚安", "对不起", "没关系", "请稍等",
-                 "很高兴认识你", "今天天气真好", "祝你好运", "生日快乐", "新年快乐"],
-        "target_langs": ["英语", "日语", "法语", "德语", "西班牙语", "韩语", "俄语", "阿拉伯语"],
-        "currencies_from": ["美元", "人民币", "欧元", "英镑", "日元"],
-        "currencies_to": ["人民币", "美元", "欧元", "英镑", "港币"],
-        "amounts": [100, 500, 1000, 50, 200, 5000, 10000],
-        "news_categories": ["科技", "体育", "财经", "娱乐", "国际", "社会", "军事", "健康"]
+                          "量子计算", "元宇宙", "Web3", "神经网络", "计算机视觉", "语音识别"),
+        "texts": ("你好", "谢谢", "再见", "早上好", "晚安", "对不起", "没关系", "请稍等",
+                 "很高兴认识你", "今天天气真好", "祝你好运", "生日快乐", "新年快乐"),
+        "target_langs": ("英语", "日语", "法语", "德语", "西班牙语", "韩语", "俄语", "阿拉伯语"),
+        "currencies_from": ("美元", "人民币", "欧元", "英镑", "日元"),
+        "currencies_to": ("人民币", "美元", "欧元", "英镑", "港币"),
+        "amounts": (100, 500, 1000, 50, 200, 5000, 10000),
+        "news_categories": ("科技", "体育", "财经", "娱乐", "国际", "社会", "军事", "健康")
     }
 
-    # 多轮对话的连接词
-    MULTI_TURN_CONNECTORS = [
+    # 多轮对话的连接词（元组冻结）
+    MULTI_TURN_CONNECTORS: ClassVar[tuple] = (
         "然后",
         "接着",
         "同时",
@@ -192,7 +267,7 @@ class TaskGenerator:
         "还有",
         "并且",
         "以及"
-    ]
+    )
 
     def __init__(self, tool_registry: ToolRegistry):
         """
@@ -203,6 +278,7 @@ class TaskGenerator:
         """
         self.tool_registry = tool_registry
         self.logger = setup_logger("TaskGenerator")
+        self._sampler = _BatchSampler()
 
     def generate_tasks(
         self,
@@ -224,9 +300,15 @@ class TaskGenerator:
 
         Returns:
             任务列表
+
+        Note:
+            有意保持单进程：任务生成是纯字符串拼接（10万任务约1.5秒），
+            而把Task/Tool对象跨进程pickle回主进程的开销比生成本身还高，
+            且会破坏工具实例共享缓存与seed的可复现性，多进程反而更慢。
         """
         if seed is not None:
             random.seed(seed)
+            self._sampler.reset()
 
         tasks = []
         num_multi = int(num_samples * multi_ratio)
@@ -341,75 +423,61 @@ class TaskGenerator:
         return task
 
     def _generate_query_for_tool(self, tool: Tool) -> str:
-        """为单个工具生成自然语言问题（增强多样性）"""
-        tool_name = tool.name.lower()
-        tool_desc = tool.description.lower()
-
-        # 根据工具名称和描述推断类别
-        if "weather" in tool_name or "天气" in tool_name or "天气" in tool_desc:
-            template = random.choice(self.TASK_TEMPLATES["天气查询"])
-            return template.format(city=random.choice(self.PARAMS["cities"]))
-
-        elif "time" in tool_name or "时间" in tool_name or "clock" in tool_name:
-            template = random.choice(self.TASK_TEMPLATES["时间查询"])
-            return template
-
-        elif "calc" in tool_name or "计算" in tool_name or "math" in tool_name:
-            template = random.choice(self.TASK_TEMPLATES["计算"])
-            return template.format(expr=random.choice(self.PARAMS["expressions"]))
-
-        elif "search" in tool_name or "搜索" in tool_name or "查询" in tool_desc:
-            template = random.choice(self.TASK_TEMPLATES["搜索"])
-            return template.format(query=random.choice(self.PARAMS["search_queries"]))
-
-        elif "translate" in tool_name or "翻译" in tool_name:
-            template = random.choice(self.TASK_TEMPLATES["翻译"])
-            return template.format(
-                text=random.choice(self.PARAMS["texts"]),
-                target_lang=random.choice(self.PARAMS["target_langs"])
+        """为单个工具生成自然语言问题（类别与模板解析均已预计算）"""
+        template_key = tool._template_key
+        render, fields = self._sampler.pick(self._COMPILED_TEMPLATES[template_key])
+
+        if template_key == "天气查询":
+            return render(city=self._sampler.pick(self.PARAMS["cities"]))
+
+        elif template_key == "时间查询":
+            return render()
+
+        elif template_key == "计算":
+            return render(expr=self._sampler.pick(self.PARAMS["expressions"]))
+
+        elif template_key == "搜索":
+            return render(query=self._sampler.pick(self.PARAMS["search_queries"]))
+
+        elif template_key == "翻译":
+            return render(
+                text=self._sampler.pick(self.PARAMS["texts"]),
+                target_lang=self._sampler.pick(self.PARAMS["target_langs"])
             )
 
-        elif "currency" in tool_name or "convert" in tool_name or "汇率" in tool_name or "货币" in tool_desc:
-            template = random.choice(self.TASK_TEMPLATES["货币转换"])
-            return template.format(
-                amount=random.choice(self.PARAMS["amounts"]),
-                from_currency=random.choice(self.PARAMS["currencies_from"]),
-                to_currency=random.choice(self.PARAMS["currencies_to"])
+        elif template_key == "货币转换":
+            return render(
+                amount=self._sampler.pick(self.PARAMS["amounts"]),
+                from_currency=self._sampler.pick(self.PARAMS["currencies_from"]),
+                to_currency=self._sampler.pick(self.PARAMS["currencies_to"])
             )
 
-        elif "news" in tool_name or "新闻" in tool_name or "资讯" in tool_desc:
-            template = random.choice(self.TASK_TEMPLATES["新闻获取"])
-            return template.format(category=random.choice(self.PARAMS["news_categories"]))
+        elif template_key == "新闻获取":
+            return render(category=self._sampler.pick(self.PARAMS["news_categories"]))
 
         else:
             # 通用模板：基于工具描述生成
-            template = random.choice(self.TASK_TEMPLATES["通用"])
-            if "{tool_name}" in template:
-                return template.format(tool_name=tool.description)
+            if "tool_name" in fields:
+                return render(tool_name=tool.description)
             else:
                 return f"请使用{tool.description}的功能帮我完成任务"
 
     def _generate_multi_turn_query(self, tools: List[Tool]) -> str:
-        """为多个工具生成组合问题"""
-        queries = []
-        for tool in tools:
-            query = self._generate_query_for_tool(tool)
-            queries.append(query)
+        """为多个工具生成组合问题（一次join拼接，避免逐段字符串累加的二次复制）"""
+        queries = [self._generate_query_for_tool(tool) for tool in tools]
 
         # 使用连接词连接
         if len(queries) == 2:
-            connector = random.choice(self.MULTI_TURN_CONNECTORS)
-            return f"{queries[0]}，{connector}{queries[1]}"
-        else:
-            # 3个或更多
-            combined = queries[0]
-            for i, query in enumerate(queries[1:], 1):
-                if i == len(queries) - 1:
-                    combined += f"，最后{query}"
-                else:
-                    connector = random.choice(self.MULTI_TURN_CONNECTORS)
-                    combined += f"，{connector}{query}"
-            return combined
+            return f"{queries[0]}，{self._sampler.pick(self.MULTI_TURN_CONNECTORS)}{queries[1]}"
+
+        # 3个或更多
+        parts = [queries[0]]
+        for i, query in enumerate(queries[1:], 1):
+            if i == len(queries) - 1:
+                parts.append(f"，最后{query}")
+            else:
+                parts.append(f"，{self._sampler.pick(self.MULTI_TURN_CONNECTORS)}{query}")
+        return "".join(parts)
 
     def create_custom_task(
         self,
@@ -457,3 +525,10 @@ class TaskGenerator:
         )
 
         return task
+
+
+# 模板在导入时解析一次，生成任务时只做拼接
+TaskGenerator._COMPILED_TEMPLATES = {
+    key: [_compile_template(template) for template in templates]
+    for key, templates in TaskGenerator.TASK_TEMPLATES.items()
+}
@@ -5,14 +5,42 @@
 
 import json
 import random
-from typing import Dict, List, Optional
-from pathlib import Path
+import re
+from typing import Dict, List, Optional, Tuple
 from .utils import setup_logger, load_json, validate_json_structure
 
+# 类别关键词编译成交替正则：一次线性扫描收集全部命中，替代逐类别的
+# 子串探测；名称和描述的关键词集合不同，分别编译
+_NAME_KW_RE = re.compile(
+    "(?P<weather>weather|天气)|(?P<time>time|时间|clock)|(?P<calc>calc|计算|math)|"
+    "(?P<search>search|搜索)|(?P<translate>translate|翻译)|"
+    "(?P<currency>currency|convert|汇率)|(?P<news>news|新闻)"
+)
+_DESC_KW_RE = re.compile(
+    "(?P<weather>天气)|(?P<search>查询)|(?P<currency>货币)|(?P<news>资讯)"
+)
+
+# 命中组名到任务模板类别的优先级表（顺序与原有if/elif链一致）
+_KW_PRIORITY = (
+    ("weather", "天气查询"),
+    ("time", "时间查询"),
+    ("calc", "计算"),
+    ("search", "搜索"),
+    ("translate", "翻译"),
+    ("currency", "货币转换"),
+    ("news", "新闻获取"),
+)
+
 
 class Tool:
     """工具定义类"""
 
+    # 固定属性布局：大量工具实例被任务共享引用，省掉每实例的__dict__
+    __slots__ = (
+        "name", "description", "parameters", "version", "category",
+        "_template_key", "_cached_dict", "_cached_json",
+    )
+
     def __init__(
         self,
         name: str,
@@ -26,14 +54,42 @@ class Tool:
         self.parameters = parameters
         self.version = version
         self.category = category
+        # 任务模板类别在注册时计算一次；工具字段加载后不变，
+        # 任务生成热路径只需读这个属性，不再做逐次子串扫描
+        self._template_key = self._classify_template_key()
+        # to_dict/JSON片段缓存（同一工具会出现在成千上万个任务里）
+        self._cached_dict: Optional[Dict] = None
+        self._cached_json: Optional[str] = None
+
+    def _classify_template_key(self) -> str:
+        """根据名称和描述推断任务模板类别（与TaskGenerator.TASK_TEMPLATES的键对应）
+
+        两次正则扫描收集所有命中的关键词组，再按固定优先级取第一个，
+        与原先的逐关键词if/elif链结果一致。
+        """
+        hits = {m.lastgroup for m in _NAME_KW_RE.finditer(self.name.lower())}
+        hits.update(m.lastgroup for m in _DESC_KW_RE.finditer(self.description.lower()))
+
+        for group, template_key in _KW_PRIORITY:
+            if group in hits:
+                return template_key
+        return "通用"
 
     def to_dict(self) -> Dict:
-        """转换为字典格式"""
-        return {
-            "name": f"{self.name}@{self.version}",
-            "description": self.description,
-            "parameters": self.parameters
-        }
+        """转换为字典格式（结果缓存；工具注册后字段不变）"""
+        if self._cached_dict is None:
+            self._cached_dict = {
+                "name": f"{self.name}@{self.version}",
+                "description": self.description,
+                "parameters": self.parameters
+            }
+        return self._cached_dict
+
+    def to_json(self) -> str:
+        """返回工具定义的JSON片段（缓存，任务序列化时直接拼接而非重新dumps）"""
+        if self._cached_json is None:
+            self._cached_json = json.dumps(self.to_dict(), ensure_ascii=False)
+        return self._cached_json
 
     def to_openai_format(self) -> Dict:
         """转换为OpenAI函数调用格式"""
@@ -50,6 +106,10 @@ class Tool:
         return f"Tool(name={self.name}@{self.version}, category={self.category})"
 
 
+# 工具定义的必需字段（提前冻结，加载循环里不再重建列表）
+_TOOL_REQUIRED = frozenset(("name", "description", "parameters"))
+
+
 class ToolRegistry:
     """工具注册中心"""
 
@@ -63,6 +123,8 @@ class ToolRegistry:
         self.logger = setup_logger("ToolRegistry")
         self.tools: List[Tool] = []
         self.tool_dict: Dict[str, Tool] = {}
+        # get_all_tools的只读元组缓存；工具列表变化时置空
+        self._all_tools_cache: Optional[Tuple[Tool, ...]] = None
 
         if config_path:
             self.load_tools(config_path)
@@ -75,12 +137,13 @@ class ToolRegistry:
             config_path: 配置文件路径
         """
         try:
-            if not Path(config_path).exists():
+            # EAFP：直接打开文件，省掉一次额外的stat系统调用
+            try:
+                data = load_json(config_path)
+            except FileNotFoundError:
                 self.logger.error(f"配置文件不存在: {config_path}")
                 return
 
-            data = load_json(config_path)
-
             # 支持两种格式：列表或字典
             if isinstance(data, list):
                 tools_data = data
@@ -91,7 +154,7 @@ class ToolRegistry:
                 return
 
             for tool_data in tools_data:
-                if not validate_json_structure(tool_data, ["name", "description", "parameters"]):
+                if not validate_json_structure(tool_data, _TOOL_REQUIRED):
                     self.logger.warning(f"工具定义缺少必需字段，跳过: {tool_data.get('name', 'unknown')}")
                     continue
 
@@ -107,6 +170,7 @@ class ToolRegistry:
                 tool_key = f"{tool.name}@{tool.version}"
                 self.tool_dict[tool_key] = tool
 
+            self._all_tools_cache = None
             self.logger.info(f"成功加载 {len(self.tools)} 个工具")
 
         except Exception as e:
@@ -163,9 +227,11 @@ class ToolRegistry:
         self.logger.debug(f"采样了 {sample_size} 个工具")
         return sampled
 
-    def get_all_tools(self) -> List[Tool]:
-        """获取所有工具"""
-        return self.tools.copy()
+    def get_all_tools(self) -> Tuple[Tool, ...]:
+        """获取所有工具（只读元组视图，缓存到下次加载；调用方不应修改）"""
+        if self._all_tools_cache is None:
+            self._all_tools_cache = tuple(self.tools)
+        return self._all_tools_cache
 
     def get_tools_by_category(self, category: str) -> List[Tool]:
         """根据类别获取工具"""
@@ -185,8 +251,7 @@ class ToolRegistry:
         Returns:
             是否合法
         """
-        required_keys = ["name", "description", "parameters"]
-        if not validate_json_structure(tool_data, required_keys):
+        if not validate_json_structure(tool_data, _TOOL_REQUIRED):
             return False
 
         # 验证parameters结构
@@ -48,8 +48,8 @@ class AutoToolDPO:
         self.exporter = None
         self.engine = None
 
-    def initialize(self):
-        """初始化所有组件"""
+    async def initialize(self):
+        """初始化所有组件（在事件循环内执行，以便预热HTTP连接池）"""
         self.logger.info("=" * 80)
         self.logger.info("AutoToolDPO 系统初始化")
         self.logger.info("=" * 80)
@@ -74,7 +74,10 @@ class AutoToolDPO:
         self.synthesizer = DataSynthesizer(self.llm_client)
 
         # 5. 初始化验证器
-        self.validator = Validator(strict_mode=self.config.get("strict_validation", False))
+        self.validator = Validator(
+            strict_mode=self.config.get("strict_validation", False),
+            concurrency=self.config["concurrency"]
+        )
 
         # 6. 初始化导出器
         ensure_dir(self.config["output_dir"])
@@ -90,6 +93,9 @@ class AutoToolDPO:
         # 添加进度回调
         self.engine.add_progress_callback(self._on_progress_update)
 
+        # 在事件循环内预建共享HTTP会话与连接池，首个LLM请求不再付建连开销
+        self.llm_client._get_session()
+
         self.logger.info("系统初始化完成")
 
     async def run(self):
@@ -121,10 +127,14 @@ class AutoToolDPO:
         # 2. 并发处理任务
         self.logger.info(f"开始并发处理任务（并发度={self.config['concurrency']}）...")
 
+        # 断点文件：崩溃重跑时（相同seed/配置）跳过已完成样本，导出成功后删除
+        checkpoint_file = str(Path(self.config["output_dir"]) / "generation_checkpoint.jsonl")
+
         valid_samples, invalid_samples = await self.engine.process_tasks(
             tasks=tasks,
             enable_validation=True,
-            enable_correction=self.config.get("auto_correction", False)
+            enable_correction=self.config.get("auto_correction", False),
+            checkpoint_file=checkpoint_file
         )
 
         self.logger.info(f"处理完成: 有效样本={len(valid_samples)}, 无效样本={len(invalid_samples)}")
@@ -138,21 +148,20 @@ class AutoToolDPO:
             batch_size=self.config.get("batch_size", 1000)
         )
 
-        # 生成dataset_info.json
-        dataset_info_path = self.exporter.generate_dataset_info(
+        # 收尾产物（dataset_info/统计/无效样本）并行落盘
+        stats = self.engine.get_stats()
+        artifacts = self.exporter.export_run_artifacts(
+            stats=stats,
+            invalid_samples=invalid_samples,
             dataset_name="tool_dpo_dataset",
             file_name="data_dpo.jsonl" if len(file_paths) == 1 else "data_dpo_*.jsonl",
             config=self.config
         )
+        if artifacts["invalid_samples"]:
+            self.logger.info(f"无效样本已导出: {artifacts['invalid_samples']}")
 
-        # 导出统计信息
-        stats = self.engine.get_stats()
-        stats_path = self.exporter.export_statistics(stats)
-
-        # 导出无效样本（调试用）
-        if invalid_samples:
-            invalid_path = self.exporter.export_invalid_samples(invalid_samples)
-            self.logger.info(f"无效样本已导出: {invalid_path}")
+        # 数据已安全落盘，移除断点文件避免影响下一次全新运行
+        Path(checkpoint_file).unlink(missing_ok=True)
 
         # 4. 生成摘要
         summary = self.exporter.get_export_summary(file_paths)
@@ -168,6 +177,9 @@ class AutoToolDPO:
         self.logger.info(f"生成速率: {stats['rate']:.2f} 样本/秒")
         self.logger.info(f"验证成功率: {stats['validation_success_rate']:.2f}%")
 
+        # 释放LLM客户端的HTTP连接池
+        await self.llm_client.aclose()
+
     def _on_progress_update(self, stats: ProgressStats):
         """进度更新回调"""
         if stats.completed_tasks % 10 == 0:  # 每10个样本打印一次
@@ -288,6 +300,14 @@ def parse_arguments():
 
 def main():
     """主函数"""
+    # 优先使用uvloop事件循环（生成流程几乎全是网络I/O的await，
+    # C实现的循环能明显降低每次调度的开销；Windows等平台回退到默认循环）
+    try:
+        import uvloop
+        uvloop.install()
+    except ImportError:
+        pass
+
     # 解析参数
     args = parse_arguments()
 
@@ -297,12 +317,14 @@ def main():
     # 创建控制器
     controller = AutoToolDPO(config)
 
-    # 初始化
-    controller.initialize()
+    # 初始化与运行共用同一个事件循环：aiohttp会话在循环内创建并预热，
+    # 避免初始化放在循环外导致连接池无法提前建立
+    async def _amain():
+        await controller.initialize()
+        await controller.run()
 
-    # 运行
     try:
-        asyncio.run(controller.run())
+        asyncio.run(_amain())
     except KeyboardInterrupt:
         controller.logger.info("用户中断，程序退出")
     except Exception as e:
@@ -5,7 +5,13 @@ LLM客户端模块
 
 import asyncio
 import aiohttp
+import hashlib
 import json
+import orjson
+import random
+import re
+import time
+from collections import deque, OrderedDict
 from typing import Dict, List, Optional, Any
 import sys
 import os
@@ -13,6 +19,174 @@ import os
 sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 from core.utils import setup_logger
 
+# 值得重试的HTTP状态码：超时、限流和暂时性服务端错误；其余4xx重试无意义
+_RETRYABLE_STATUS = frozenset({408, 429, 500, 502, 503, 504})
+
+# Markdown代码块包裹的JSON（DeepSeek常见问题），一次匹配直接提取内容
+_FENCE_RE = re.compile(r"^\s*```(?:json)?\s*\n?(.*?)\n?\s*```\s*$", re.DOTALL)
+
+# 大段提示词模板在模块加载时冻结一份，每次调用只做占位符替换，
+# 不再按样本重新拼接多KB的字符串字面量
+_REJECTION_TEMPLATE = """
+{system_prompt}
+
+现在，请你故意生成一个不太准确或不是最优的回复。可以是：
+1. 调用了错误的工具
+2. 参数不完整或不准确
+3. 调用顺序不合理
+4. 忘记调用必要的工具
+5. 完全不调用工具（直接回答或拒绝回答）
+6. 误解用户意图
+
+不需要保证格式正确，可以有各种形式的错误回复。
+"""
+
+_VALIDATION_TEMPLATE = """
+请检查以下DPO训练样本的质量：
+
+用户问题：{user_query}
+可用工具：{tools}
+Chosen回复：{chosen}
+Rejected回复：{rejected}
+
+请评估以下方面：
+
+1. **Chosen回复质量** (是否正确调用了工具，参数是否准确)
+2. **Rejected回复质量** (是否确实比chosen更差)
+3. **两者差异度** (差异是否明显，是否具有学习价值)
+4. **格式规范性** (是否符合function_call格式要求)
+
+请以JSON格式回复，必须包含以下字段：
+{{
+  "is_valid": true/false,  # 样本是否整体合格
+  "quality_score": 8.5,  # 0-10分，chosen的质量评分
+  "similarity_score": 25.0,  # 0-100，chosen和rejected的相似度百分比（越低越好，<80%为佳）
+  "issues": ["问题1", "问题2"],  # 发现的问题列表
+  "corrected_chosen": "修正后的chosen（如果需要修正）",  # 没有问题则返回原内容
+  "corrected_rejected": "修正后的rejected（如果需要修正）"  # 没有问题则返回原内容
+}}
+
+评分标准：
+- quality_score: 9-10极好，7-8良好，5-6一般，<5差
+- similarity_score: <50%优秀，50-80%良好，>80%需要改进（说明rejected不够差）
+"""
+
+_FOLLOW_UP_TEMPLATE = """
+根据之前的对话，生成一个合理的追问。追问应该：
+1. 与之前的对话内容相关
+2. 需要调用工具来回答
+3. 是用户可能会问的自然问题
+
+可用工具：
+{tools}
+
+请直接生成追问，不要包含其他内容。
+"""
+
+
+class AdaptiveConcurrencyLimiter:
+    """AIMD自适应并发限流器
+
+    模仿TCP拥塞控制：每累计increase_every次成功请求把并发上限加1（加性增），
+    遇到限流或服务端错误时上限减半（乘性减）。固定并发数要么用不满高配额
+    的API档位，要么在低配额档位上持续撞429；这里让上限自动收敛到服务端
+    实际能承受的水平，无需按档位手工调参。
+    """
+
+    def __init__(
+        self,
+        initial_limit: int = 32,
+        min_limit: int = 4,
+        max_limit: int = 256,
+        increase_every: int = 50
+    ):
+        self.limit = initial_limit
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.increase_every = increase_every
+        self._inflight = 0
+        self._successes = 0
+        self._waiters: deque = deque()
+
+    async def acquire(self) -> None:
+        """获取一个并发槽位，满载时挂起等待"""
+        while self._inflight >= self.limit:
+            future = asyncio.get_running_loop().create_future()
+            self._waiters.append(future)
+            await future
+        self._inflight += 1
+
+    def release(self) -> None:
+        """释放槽位并唤醒等待方"""
+        self._inflight -= 1
+        self._wake_waiters()
+
+    def on_success(self) -> None:
+        """成功计数，按阈值加性提升上限"""
+        self._successes += 1
+        if self._successes >= self.increase_every:
+            self._successes = 0
+            if self.limit < self.max_limit:
+                self.limit += 1
+                self._wake_waiters()
+
+    def on_throttle(self) -> None:
+        """遇到429/5xx时乘性降低上限"""
+        self.limit = max(self.min_limit, self.limit // 2)
+        self._successes = 0
+
+    def _wake_waiters(self) -> None:
+        available = self.limit - self._inflight
+        while self._waiters and available > 0:
+            future = self._waiters.popleft()
+            if not future.done():
+                future.set_result(None)
+                available -= 1
+
+
+class LLMCache:
+    """确定性请求的进程内响应缓存（LRU + TTL）
+
+    只对temperature=0的请求生效：相同(model, messages, temperature, tools)
+    必然得到相同回复，命中一次即省掉一整个LLM往返——重试、失败任务重跑
+    和重复的验证提示词都能直接命中。
+
+    Note: 刻意不对高温采样的生成请求做语义缓存（按embedding相似度把
+    近似问题映射到同一份缓存回复）。生成端用temperature 0.7-0.9采样
+    正是为了样本多样性，语义缓存会让"巴黎天气"和"查一下巴黎的天气"
+    共享同一条chosen/rejected，在数据集里批量制造近重复样本，随后又被
+    验证阶段的相似度检查拒掉——省下的调用全变成废样本。
+    """
+
+    def __init__(self, maxsize: int = 1024, ttl_seconds: float = 3600.0):
+        self.maxsize = maxsize
+        self.ttl_seconds = ttl_seconds
+        self.hits = 0
+        self.misses = 0
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+
+    def get(self, key: str) -> Optional[str]:
+        """命中则返回缓存回复并刷新LRU位置，过期/未命中返回None"""
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        value, expires_at = entry
+        if time.monotonic() > expires_at:
+            del self._entries[key]
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def set(self, key: str, value: str) -> None:
+        """写入缓存，超出容量时按LRU逐出最旧条目"""
+        self._entries[key] = (value, time.monotonic() + self.ttl_seconds)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
 
 class LLMClient:
     """大模型客户端，支持OpenAI兼容的API"""
@@ -23,7 +197,8 @@ class LLMClient:
         api_key: Optional[str] = None,
         model: str = "gpt-3.5-turbo",
         timeout: int = 60,
-        max_retries: int = 3
+        max_retries: int = 3,
+        cache: Optional[LLMCache] = None
     ):
         """
         初始化LLM客户端
@@ -34,13 +209,63 @@ class LLMClient:
             model: 模型名称
             timeout: 请求超时时间（秒）
             max_retries: 最大重试次数
+            cache: 确定性请求的响应缓存（可选，仅temperature=0时生效）
         """
         self.api_url = api_url.rstrip('/')
         self.api_key = api_key
         self.model = model
         self.timeout = timeout
         self.max_retries = max_retries
+        self.max_backoff = 30
         self.logger = setup_logger("LLMClient")
+        self.cache = cache
+        self._session: Optional[aiohttp.ClientSession] = None
+        self._limiter = AdaptiveConcurrencyLimiter()
+        # 确定性请求的single-flight表：同key的并发重复请求共享一次在途调用
+        self._inflight: Dict[str, asyncio.Task] = {}
+        # 请求头和URL在所有chat请求间不变，构造一次反复复用
+        self._chat_url = f"{self.api_url}/chat/completions"
+        self._headers = self._build_headers()
+
+    def _build_headers(self) -> Dict[str, str]:
+        """构造chat请求的固定请求头（api_key变更时重建）"""
+        headers = {"Content-Type": "application/json"}
+        if self.api_key:
+            headers["Authorization"] = f"Bearer {self.api_key}"
+        return headers
+
+    def _get_session(self) -> aiohttp.ClientSession:
+        """获取共享HTTP会话（连接池+keep-alive，避免每个请求重建TCP/TLS连接）"""
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(
+                limit=200,
+                limit_per_host=100,
+                keepalive_timeout=60
+            )
+            self._session = aiohttp.ClientSession(connector=connector)
+        return self._session
+
+    async def aclose(self) -> None:
+        """关闭共享HTTP会话（任务结束时调用）"""
+        if self._session and not self._session.closed:
+            await self._session.close()
+        self._session = None
+
+    def _backoff_delay(self, attempt: int) -> float:
+        """指数退避延迟（带随机抖动和上限）
+
+        无抖动时并发批次里所有失败请求会在t=1s/2s/4s同步重试，
+        把服务端的瞬时故障放大成重试风暴；抖动把重试摊开，上限
+        防止深度重试睡过头。
+        """
+        return min(self.max_backoff, (2 ** attempt) * (0.5 + random.random()))
+
+    async def __aenter__(self) -> "LLMClient":
+        self._get_session()
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb) -> None:
+        await self.aclose()
 
     async def chat_completion(
         self,
@@ -65,13 +290,69 @@ class LLMClient:
         Returns:
             模型回复内容
         """
-        headers = {
-            "Content-Type": "application/json"
-        }
+        # 确定性请求（temperature=0）：先查响应缓存，再通过single-flight
+        # 把并发的相同请求合并为一次在途调用，N个重复请求只打一次API
+        if temperature == 0:
+            cache_key = self._deterministic_key(messages, temperature, tools)
+            if self.cache is not None:
+                cached = self.cache.get(cache_key)
+                if cached is not None:
+                    return cached
+
+            inflight = self._inflight.get(cache_key)
+            if inflight is not None:
+                return await inflight
+
+            request_task = asyncio.create_task(
+                self._chat_completion_request(
+                    messages, temperature, max_tokens, stop, tools, **kwargs
+                )
+            )
+            self._inflight[cache_key] = request_task
+            try:
+                content = await request_task
+            finally:
+                self._inflight.pop(cache_key, None)
 
-        if self.api_key:
-            headers["Authorization"] = f"Bearer {self.api_key}"
+            if content is not None and self.cache is not None:
+                self.cache.set(cache_key, content)
+            return content
+
+        return await self._chat_completion_request(
+            messages, temperature, max_tokens, stop, tools, **kwargs
+        )
 
+    def _deterministic_key(
+        self,
+        messages: List[Dict[str, str]],
+        temperature: float,
+        tools: Optional[List[Dict]]
+    ) -> str:
+        """确定性请求的缓存/合并键（请求内容的内容哈希）"""
+        return hashlib.blake2b(
+            json.dumps(
+                {
+                    "model": self.model,
+                    "messages": messages,
+                    "temperature": temperature,
+                    "tools": tools
+                },
+                sort_keys=True,
+                ensure_ascii=False
+            ).encode("utf-8"),
+            digest_size=16
+        ).hexdigest()
+
+    async def _chat_completion_request(
+        self,
+        messages: List[Dict[str, str]],
+        temperature: float,
+        max_tokens: Optional[int],
+        stop: Optional[List[str]],
+        tools: Optional[List[Dict]],
+        **kwargs
+    ) -> Optional[str]:
+        """执行一次真实的chat completion请求（含重试），不经过缓存与合并"""
         payload = {
             "model": self.model,
             "messages": messages,
@@ -89,50 +370,205 @@ class LLMClient:
             payload["tools"] = tools
             payload["tool_choice"] = "auto"
 
+        # 请求体序列化一次（orjson比stdlib快数倍），重试时直接复用字节串，
+        # 同时绕开aiohttp内部的json.dumps
+        body = orjson.dumps(payload)
+
         for attempt in range(self.max_retries):
+            await self._limiter.acquire()
             try:
-                request_url = f"{self.api_url}/chat/completions"
-                self.logger.info(f"发送请求到: {request_url}, 模型: {self.model}")
-
-                async with aiohttp.ClientSession() as session:
-                    async with session.post(
-                        request_url,
-                        headers=headers,
-                        json=payload,
-                        timeout=aiohttp.ClientTimeout(total=self.timeout)
-                    ) as response:
-                        if response.status == 200:
-                            result = await response.json()
-                            content = result["choices"][0]["message"]["content"]
-                            return content
+                self.logger.info(f"发送请求到: {self._chat_url}, 模型: {self.model}")
+
+                session = self._get_session()
+                async with session.post(
+                    self._chat_url,
+                    headers=self._headers,
+                    data=body,
+                    timeout=aiohttp.ClientTimeout(total=self.timeout)
+                ) as response:
+                    if response.status == 200:
+                        # orjson的C解析器比stdlib快数倍，且只做一次整体分配
+                        result = orjson.loads(await response.read())
+                        content = result["choices"][0]["message"]["content"]
+                        self._limiter.on_success()
+                        return content
+                    else:
+                        # 只读取前2KB用于日志，避免把超大错误体整个吞进内存
+                        error_text = (await response.content.read(2048)).decode("utf-8", "replace")
+                        self.logger.error(f"API请求失败 (状态码 {response.status}): {error_text}")
+
+                        if response.status in _RETRYABLE_STATUS:
+                            if response.status == 429 or response.status >= 500:
+                                # 限流/服务器错误：并发上限减半后退避重试
+                                self._limiter.on_throttle()
+                            if attempt < self.max_retries - 1:
+                                retry_after = response.headers.get("Retry-After")
+                                if retry_after and retry_after.isdigit():
+                                    delay = int(retry_after)
+                                else:
+                                    delay = self._backoff_delay(attempt)
+                                await asyncio.sleep(delay)
+                                continue
                         else:
-                            error_text = await response.text()
-                            self.logger.error(f"API请求失败 (状态码 {response.status}): {error_text}")
-
-                            if response.status >= 500:
-                                # 服务器错误，重试
-                                if attempt < self.max_retries - 1:
-                                    await asyncio.sleep(2 ** attempt)
-                                    continue
-                            else:
-                                # 客户端错误，不重试
-                                return None
+                            # 其他客户端错误，不重试
+                            return None
 
             except asyncio.TimeoutError:
                 self.logger.warning(f"请求超时 (尝试 {attempt + 1}/{self.max_retries})")
                 if attempt < self.max_retries - 1:
-                    await asyncio.sleep(2 ** attempt)
+                    await asyncio.sleep(self._backoff_delay(attempt))
                     continue
 
             except Exception as e:
                 self.logger.error(f"请求异常: {str(e)}")
                 if attempt < self.max_retries - 1:
-                    await asyncio.sleep(2 ** attempt)
+                    await asyncio.sleep(self._backoff_delay(attempt))
                     continue
 
+            finally:
+                self._limiter.release()
+
         self.logger.error(f"达到最大重试次数，请求失败")
         return None
 
+    async def chat_completion_stream(
+        self,
+        messages: List[Dict[str, str]],
+        temperature: float = 0.7,
+        max_tokens: Optional[int] = None,
+        stop: Optional[List[str]] = None,
+        tools: Optional[List[Dict]] = None,
+        max_response_bytes: int = 1 << 20,
+        **kwargs
+    ) -> Optional[str]:
+        """
+        流式调用chat completion API（SSE），带回复字节预算
+
+        未设max_tokens时普通调用只能等服务端生成完整个失控长回复；
+        流式路径边收边拼，超出预算立即断开连接，截断点之后的字节
+        既不传输也不付费等待。
+
+        Args:
+            messages: 消息列表
+            temperature: 温度参数
+            max_tokens: 最大token数
+            stop: 停止词列表
+            tools: 工具列表（OpenAI格式）
+            max_response_bytes: 回复内容的字节预算，超出即截断（默认1MB）
+            **kwargs: 其他参数
+
+        Returns:
+            模型回复内容（可能被预算截断），失败返回None
+        """
+        payload = {
+            "model": self.model,
+            "messages": messages,
+            "temperature": temperature,
+            "stream": True,
+            **kwargs
+        }
+
+        if max_tokens:
+            payload["max_tokens"] = max_tokens
+
+        if stop:
+            payload["stop"] = stop
+
+        if tools:
+            payload["tools"] = tools
+            payload["tool_choice"] = "auto"
+
+        body = orjson.dumps(payload)
+
+        await self._limiter.acquire()
+        try:
+            session = self._get_session()
+            async with session.post(
+                self._chat_url,
+                headers=self._headers,
+                data=body,
+                timeout=aiohttp.ClientTimeout(total=self.timeout)
+            ) as response:
+                if response.status != 200:
+                    error_text = (await response.content.read(2048)).decode("utf-8", "replace")
+                    self.logger.error(f"流式请求失败 (状态码 {response.status}): {error_text}")
+                    if response.status == 429 or response.status >= 500:
+                        self._limiter.on_throttle()
+                    return None
+
+                parts: List[str] = []
+                received = 0
+                async for raw_line in response.content:
+                    line = raw_line.strip()
+                    if not line.startswith(b"data:"):
+                        continue
+                    data = line[5:].strip()
+                    if data == b"[DONE]":
+                        break
+                    try:
+                        chunk = orjson.loads(data)
+                    except orjson.JSONDecodeError:
+                        continue
+                    choices = chunk.get("choices")
+                    if not choices:
+                        continue
+                    delta = choices[0].get("delta", {}).get("content")
+                    if delta:
+                        parts.append(delta)
+                        received += len(delta)
+                        if received > max_response_bytes:
+                            # 提前跳出会关闭响应，剩余字节不再传输
+                            self.logger.warning(
+                                f"回复超出字节预算({max_response_bytes})，已截断"
+                            )
+                            break
+
+                self._limiter.on_success()
+                return "".join(parts) or None
+
+        except Exception as e:
+            self.logger.error(f"流式请求异常: {str(e)}")
+            return None
+
+        finally:
+            self._limiter.release()
+
+    async def chat_completion_batch(
+        self,
+        messages_list: List[List[Dict[str, str]]],
+        **kwargs
+    ) -> List[Optional[str]]:
+        """
+        并发执行一批chat completion请求
+
+        N个独立请求串行await就是N个串行RTT；这里用gather一次性扇出，
+        让网络延迟相互重叠。并发上限由chat_completion内部的AIMD限流器
+        统一控制，无需在此额外加信号量。
+
+        Args:
+            messages_list: 消息列表的列表，每项对应一次独立请求
+            **kwargs: 透传给chat_completion的参数（temperature等）
+
+        Returns:
+            与messages_list等长的回复列表，失败项为None
+        """
+        if not messages_list:
+            return []
+
+        results = await asyncio.gather(
+            *(self.chat_completion(messages, **kwargs) for messages in messages_list),
+            return_exceptions=True
+        )
+
+        outputs: List[Optional[str]] = []
+        for result in results:
+            if isinstance(result, BaseException):
+                self.logger.error(f"批量请求中的单项异常: {result}")
+                outputs.append(None)
+            else:
+                outputs.append(result)
+        return outputs
+
     async def generate_function_call(
         self,
         user_query: str,
@@ -179,17 +615,25 @@ class LLMClient:
         Returns:
             正确的回复
         """
+        messages = self.build_chosen_messages(user_query, system_prompt, tools_json)
+        response = await self.chat_completion(messages, temperature=temperature)
+        return response
+
+    def build_chosen_messages(
+        self,
+        user_query: str,
+        system_prompt: str,
+        tools_json: str
+    ) -> List[Dict[str, str]]:
+        """构造chosen生成的消息列表（实时调用和Batch API共用）"""
         # 添加明确的指令
         enhanced_system = system_prompt + "\n\n请务必准确理解用户意图，选择最合适的工具进行调用。"
 
-        messages = [
+        return [
             {"role": "system", "content": enhanced_system},
             {"role": "user", "content": f"可用工具：\n{tools_json}\n\n请根据以下问题调用合适的工具：{user_query}"}
         ]
 
-        response = await self.chat_completion(messages, temperature=temperature)
-        return response
-
     async def generate_rejected_response(
         self,
         user_query: str,
@@ -213,20 +657,27 @@ class LLMClient:
         Returns:
             错误的回复
         """
-        # 构造提示，让模型生成一个"不太正确"的回复
-        rejection_prompt = f"""
-{system_prompt}
-
-现在，请你故意生成一个不太准确或不是最优的回复。可以是：
-1. 调用了错误的工具
-2. 参数不完整或不准确
-3. 调用顺序不合理
-4. 忘记调用必要的工具
-5. 完全不调用工具（直接回答或拒绝回答）
-6. 误解用户意图
+        messages = self.build_rejected_messages(
+            user_query=user_query,
+            system_prompt=system_prompt,
+            tools_json=tools_json,
+            chosen_response=chosen_response,
+            conversation_history=conversation_history
+        )
+        response = await self.chat_completion(messages, temperature=temperature)
+        return response
 
-不需要保证格式正确，可以有各种形式的错误回复。
-"""
+    def build_rejected_messages(
+        self,
+        user_query: str,
+        system_prompt: str,
+        tools_json: str,
+        chosen_response: Optional[str] = None,
+        conversation_history: Optional[List[Dict]] = None
+    ) -> List[Dict[str, str]]:
+        """构造rejected生成的消息列表（实时调用和Batch API共用）"""
+        # 构造提示，让模型生成一个"不太正确"的回复
+        rejection_prompt = _REJECTION_TEMPLATE.format(system_prompt=system_prompt)
 
         if chosen_response:
             rejection_prompt += f"\n\n正确的回复示例（不要直接复制）：\n{chosen_response}\n\n现在请生成一个\"不太好\"的替代方案。"
@@ -240,13 +691,174 @@ class LLMClient:
         # 添加当前用户问题
         messages.append({"role": "user", "content": f"可用工具：\n{tools_json}\n\n用户问题：{user_query}"})
 
+        return messages
+
+    async def generate_dpo_triplet(
+        self,
+        user_query: str,
+        system_prompt: str,
+        tools_json: str,
+        conversation_history: Optional[List[Dict]] = None,
+        temperature: float = 0.8
+    ) -> Optional[Dict]:
+        """
+        单次调用生成DPO三元组（chosen + rejected + 自评）
+
+        把chosen生成、rejected生成和质量自评合并为一个结构化输出请求，
+        三次prefill和网络往返压缩为一次，且system/tools前缀只发送一份。
+
+        Args:
+            user_query: 用户问题
+            system_prompt: 系统提示词
+            tools_json: 工具定义JSON字符串
+            conversation_history: 对话历史（可选）
+            temperature: 温度参数
+
+        Returns:
+            {"chosen": str, "rejected": str, "quality_score": float, "similarity_score": float}
+            失败返回None
+        """
+        triplet_prompt = f"""
+{system_prompt}
+
+用户问题：{user_query}
+
+可用工具：
+{tools_json}
+
+请为上面的用户问题构造一组DPO偏好对比数据，以JSON格式输出，必须包含以下字段：
+{{
+  "chosen": "正确的回复：准确理解用户意图，规范地调用最合适的工具",
+  "rejected": "较差的回复：可以是调用错误的工具、参数不完整、不调用工具直接回答、误解用户意图等",
+  "quality_score": 8.5,
+  "similarity_score": 25.0
+}}
+
+要求：
+1. chosen和rejected必须有明显差异（similarity_score为两者相似度0-100，越低越好）
+2. chosen中的工具调用使用<function_call>标签，最终回答使用<final>标签
+3. quality_score为chosen的质量自评（0-10分）
+4. 只输出JSON，不要包含其他内容
+"""
+
+        messages = [{"role": "system", "content": "你是一个DPO训练数据构造专家，擅长构造高质量的偏好对比数据。"}]
+
+        if conversation_history:
+            messages.extend(conversation_history)
+
+        messages.append({"role": "user", "content": triplet_prompt})
+
         response = await self.chat_completion(messages, temperature=temperature)
-        return response
+
+        if not response:
+            return None
+
+        try:
+            result = json.loads(self._clean_json_response(response))
+        except json.JSONDecodeError as e:
+            self.logger.warning(f"三元组结果解析失败，回退到分步生成: {str(e)}")
+            return None
+
+        if not result.get("chosen") or not result.get("rejected"):
+            self.logger.warning("三元组结果缺少chosen或rejected，回退到分步生成")
+            return None
+
+        result.setdefault("quality_score", 7.0)
+        result.setdefault("similarity_score", 50.0)
+        return result
+
+    async def generate_dpo_pairs_packed(
+        self,
+        queries: List[Dict[str, str]],
+        system_prompt: str,
+        tools_json: str,
+        temperature: float = 0.8
+    ) -> Optional[Dict[str, Dict]]:
+        """
+        一次调用为共享相同system/tools前缀的K个问题生成K组DPO偏好对
+
+        短输出场景下单请求的HTTP/排队/prefill开销占大头，把K个任务打包进
+        一个提示词可以把这些固定成本摊到K个样本上，且共享前缀只发送一份。
+
+        Args:
+            queries: [{"task_id": str, "query": str}, ...]
+            system_prompt: 共享的系统提示词
+            tools_json: 共享的工具定义JSON字符串
+            temperature: 温度参数
+
+        Returns:
+            task_id到{"chosen", "rejected", "quality_score"}的映射，失败返回None
+        """
+        query_list = json.dumps(queries, ensure_ascii=False, indent=2)
+
+        packed_prompt = f"""
+{system_prompt}
+
+可用工具：
+{tools_json}
+
+下面是{len(queries)}个相互独立的用户问题：
+{query_list}
+
+请为每个问题分别构造一组DPO偏好对比数据，以JSON数组格式输出，数组中每个元素必须包含以下字段：
+{{
+  "task_id": "对应问题的task_id",
+  "chosen": "正确的回复：准确理解用户意图，规范地调用最合适的工具",
+  "rejected": "较差的回复：可以是调用错误的工具、参数不完整、不调用工具直接回答、误解用户意图等",
+  "quality_score": 8.5
+}}
+
+要求：
+1. 每个问题独立处理，chosen和rejected必须有明显差异
+2. chosen中的工具调用使用<function_call>标签，最终回答使用<final>标签
+3. quality_score为chosen的质量自评（0-10分）
+4. 只输出JSON数组，不要包含其他内容
+"""
+
+        messages = [
+            {"role": "system", "content": "你是一个DPO训练数据构造专家，擅长构造高质量的偏好对比数据。"},
+            {"role": "user", "content": packed_prompt}
+        ]
+
+        response = await self.chat_completion(messages, temperature=temperature)
+        if not response:
+            return None
+
+        try:
+            parsed = json.loads(self._clean_json_response(response))
+        except json.JSONDecodeError as e:
+            self.logger.warning(f"打包结果解析失败，回退到逐任务生成: {str(e)}")
+            return None
+
+        if not isinstance(parsed, list):
+            self.logger.warning("打包结果不是JSON数组，回退到逐任务生成")
+            return None
+
+        results: Dict[str, Dict] = {}
+        for item in parsed:
+            if (
+                isinstance(item, dict)
+                and item.get("task_id")
+                and item.get("chosen")
+                and item.get("rejected")
+            ):
+                item.setdefault("quality_score", 7.0)
+                results[item["task_id"]] = item
+
+        return results or None
+
+    @staticmethod
+    def _clean_json_response(response: str) -> str:
+        """清理Markdown代码块包裹（预编译正则单次扫描提取内容）"""
+        match = _FENCE_RE.match(response)
+        if match:
+            return match.group(1).strip()
+        return response.strip()
 
     async def validate_and_correct(
         self,
         sample: Dict,
-        temperature: float = 0.5
+        temperature: float = 0.0
     ) -> Dict:
         """
         验证样本并生成修正版本（增强版：包含相似度评分和质量评分）
@@ -266,42 +878,26 @@ class LLMClient:
                 "corrected_rejected": str
             }
         """
-        validation_prompt = f"""
-请检查以下DPO训练样本的质量：
-
-用户问题：{sample.get('messages', [{}])[0].get('content', '')}
-可用工具：{sample.get('tools', '')}
-Chosen回复：{sample.get('chosen', '')}
-Rejected回复：{sample.get('rejected', '')}
-
-请评估以下方面：
-
-1. **Chosen回复质量** (是否正确调用了工具，参数是否准确)
-2. **Rejected回复质量** (是否确实比chosen更差)
-3. **两者差异度** (差异是否明显，是否具有学习价值)
-4. **格式规范性** (是否符合function_call格式要求)
-
-请以JSON格式回复，必须包含以下字段：
-{{
-  "is_valid": true/false,  # 样本是否整体合格
-  "quality_score": 8.5,  # 0-10分，chosen的质量评分
-  "similarity_score": 25.0,  # 0-100，chosen和rejected的相似度百分比（越低越好，<80%为佳）
-  "issues": ["问题1", "问题2"],  # 发现的问题列表
-  "corrected_chosen": "修正后的chosen（如果需要修正）",  # 没有问题则返回原内容
-  "corrected_rejected": "修正后的rejected（如果需要修正）"  # 没有问题则返回原内容
-}}
-
-评分标准：
-- quality_score: 9-10极好，7-8良好，5-6一般，<5差
-- similarity_score: <50%优秀，50-80%良好，>80%需要改进（说明rejected不够差）
-"""
+        user_query = (sample.get('messages') or [{}])[0].get('content', '')
+        validation_prompt = _VALIDATION_TEMPLATE.format(
+            user_query=user_query,
+            tools=sample.get('tools', ''),
+            chosen=sample.get('chosen', ''),
+            rejected=sample.get('rejected', '')
+        )
 
         messages = [
             {"role": "system", "content": "你是一个DPO数据质量检查专家，擅长评估偏好对比数据的质量。"},
             {"role": "user", "content": validation_prompt}
         ]
 
-        response = await self.chat_completion(messages, temperature=temperature)
+        # JSON模式让服务端保证输出是合法JSON对象，基本消除围栏剥离和解析失败；
+        # 解析兜底仍保留，兼容不支持response_format的OpenAI兼容后端
+        response = await self.chat_completion(
+            messages,
+            temperature=temperature,
+            response_format={"type": "json_object"}
+        )
 
         try:
             if not response:
@@ -312,17 +908,7 @@ Rejected回复：{sample.get('rejected', '')}
                     "issues": []
                 }
 
-            # 清理Markdown代码块包裹（DeepSeek常见问题）
-            cleaned_response = response.strip()
-            if cleaned_response.startswith("```json"):
-                cleaned_response = cleaned_response[7:]  # 移除 ```json
-            if cleaned_response.startswith("```"):
-                cleaned_response = cleaned_response[3:]  # 移除 ```
-            if cleaned_response.endswith("```"):
-                cleaned_response = cleaned_response[:-3]  # 移除结尾的 ```
-            cleaned_response = cleaned_response.strip()
-
-            result = json.loads(cleaned_response)
+            result = json.loads(self._clean_json_response(response))
 
             # 确保所有必需字段存在
             if "quality_score" not in result:
@@ -344,6 +930,102 @@ Rejected回复：{sample.get('rejected', '')}
                 "issues": ["LLM返回格式错误"]
             }
 
+    async def validate_and_correct_batch(
+        self,
+        samples: List[Dict],
+        temperature: float = 0.0
+    ) -> List[Optional[Dict]]:
+        """
+        批量验证样本质量（多样本合并为一次请求）
+
+        评审提示词固定，把B个样本拼进同一个prompt让模型返回JSON数组，
+        将网络往返和prefill开销摊薄到整批样本上。批量模式只评分不修正。
+
+        Args:
+            samples: 样本列表
+            temperature: 温度参数
+
+        Returns:
+            与samples等长的结果列表，每项为评估字典
+            （is_valid/quality_score/similarity_score/issues），
+            单个样本缺失结果或整体失败时对应位置为None
+        """
+        if not samples:
+            return []
+
+        blocks = []
+        for idx, sample in enumerate(samples):
+            blocks.append(f"""【样本{idx}】
+用户问题：{(sample.get('messages') or [{}])[0].get('content', '')}
+可用工具：{sample.get('tools', '')}
+Chosen回复：{sample.get('chosen', '')}
+Rejected回复：{sample.get('rejected', '')}""")
+
+        validation_prompt = f"""
+请逐一检查以下 {len(samples)} 个DPO训练样本的质量：
+
+{chr(10).join(blocks)}
+
+对每个样本请评估以下方面：
+
+1. **Chosen回复质量** (是否正确调用了工具，参数是否准确)
+2. **Rejected回复质量** (是否确实比chosen更差)
+3. **两者差异度** (差异是否明显，是否具有学习价值)
+4. **格式规范性** (是否符合function_call格式要求)
+
+请以JSON数组格式回复，每个样本一个对象，必须包含以下字段：
+[
+  {{
+    "sample_id": 0,  # 对应【样本N】中的N
+    "is_valid": true/false,  # 样本是否整体合格
+    "quality_score": 8.5,  # 0-10分，chosen的质量评分
+    "similarity_score": 25.0,  # 0-100，chosen和rejected的相似度百分比（越低越好，<80%为佳）
+    "issues": ["问题1", "问题2"]  # 发现的问题列表，没有问题则为空数组
+  }}
+]
+
+评分标准：
+- quality_score: 9-10极好，7-8良好，5-6一般，<5差
+- similarity_score: <50%优秀，50-80%良好，>80%需要改进（说明rejected不够差）
+
+只返回JSON数组，不要其他内容。
+"""
+
+        messages = [
+            {"role": "system", "content": "你是一个DPO数据质量检查专家，擅长评估偏好对比数据的质量。"},
+            {"role": "user", "content": validation_prompt}
+        ]
+
+        response = await self.chat_completion(messages, temperature=temperature)
+
+        if not response:
+            return [None] * len(samples)
+
+        try:
+            parsed = json.loads(self._clean_json_response(response))
+        except json.JSONDecodeError as e:
+            self.logger.error("无法解析批量验证结果: %s... 错误: %s", response[:200], str(e))
+            return [None] * len(samples)
+
+        if not isinstance(parsed, list):
+            self.logger.error("批量验证结果不是JSON数组")
+            return [None] * len(samples)
+
+        results: List[Optional[Dict]] = [None] * len(samples)
+        for item in parsed:
+            if not isinstance(item, dict):
+                continue
+            idx = item.get("sample_id")
+            if not isinstance(idx, int) or not 0 <= idx < len(samples):
+                continue
+            item.setdefault("is_valid", True)
+            item.setdefault("quality_score", 7.0)
+            item.setdefault("similarity_score", 50.0)
+            item.setdefault("issues", [])
+            results[idx] = item
+
+        return results
+
     async def generate_follow_up_question(
         self,
         conversation_history: List[Dict],
@@ -361,22 +1043,10 @@ Rejected回复：{sample.get('rejected', '')}
         Returns:
             追问问题
         """
-        follow_up_prompt = """
-根据之前的对话，生成一个合理的追问。追问应该：
-1. 与之前的对话内容相关
-2. 需要调用工具来回答
-3. 是用户可能会问的自然问题
-
-可用工具：
-{tools}
-
-请直接生成追问，不要包含其他内容。
-"""
-
         messages = conversation_history.copy()
         messages.append({
             "role": "system",
-            "content": follow_up_prompt.format(tools=tools_json)
+            "content": _FOLLOW_UP_TEMPLATE.format(tools=tools_json)
         })
 
         response = await self.chat_completion(messages, temperature=temperature, max_tokens=200)
@@ -445,6 +1115,163 @@ Rejected回复：{sample.get('rejected', '')}
         # 移除system message（不需要保存到最终数据中）
         return [msg for msg in conversation if msg["role"] != "system"]
 
+    async def submit_batch(self, requests: List[Dict]) -> Optional[str]:
+        """
+        提交批量任务（OpenAI兼容的Batch API）
+
+        适合对延迟不敏感的离线大规模生成：服务端按24h窗口调度，
+        成本约为实时调用的一半，吞吐不受客户端并发数限制。
+
+        Args:
+            requests: 请求列表，每项为 {"custom_id": str, "body": chat_completions参数}
+
+        Returns:
+            batch_id，失败返回None
+        """
+        headers = {}
+        if self.api_key:
+            headers["Authorization"] = f"Bearer {self.api_key}"
+
+        # 构造批量输入JSONL
+        lines = [
+            json.dumps({
+                "custom_id": req["custom_id"],
+                "method": "POST",
+                "url": "/v1/chat/completions",
+                "body": req["body"]
+            }, ensure_ascii=False)
+            for req in requests
+        ]
+        jsonl_content = "\n".join(lines).encode("utf-8")
+
+        try:
+            # 复用共享会话，与chat_completion共享连接池
+            session = self._get_session()
+
+            # 1. 上传输入文件
+            form = aiohttp.FormData()
+            form.add_field("purpose", "batch")
+            form.add_field(
+                "file",
+                jsonl_content,
+                filename="batch_input.jsonl",
+                content_type="application/jsonl"
+            )
+
+            async with session.post(
+                f"{self.api_url}/files",
+                headers=headers,
+                data=form
+            ) as response:
+                if response.status != 200:
+                    error_text = await response.text()
+                    self.logger.error(f"批量输入文件上传失败 (状态码 {response.status}): {error_text}")
+                    return None
+                input_file_id = (await response.json())["id"]
+
+            # 2. 创建批量任务
+            async with session.post(
+                f"{self.api_url}/batches",
+                headers={**headers, "Content-Type": "application/json"},
+                json={
+                    "input_file_id": input_file_id,
+                    "endpoint": "/v1/chat/completions",
+                    "completion_window": "24h"
+                }
+            ) as response:
+                if response.status != 200:
+                    error_text = await response.text()
+                    self.logger.error(f"批量任务创建失败 (状态码 {response.status}): {error_text}")
+                    return None
+                batch_id = (await response.json())["id"]
+
+            self.logger.info(f"批量任务已提交: {batch_id} (共{len(requests)}个请求)")
+            return batch_id
+
+        except Exception as e:
+            self.logger.error(f"提交批量任务异常: {str(e)}")
+            return None
+
+    async def wait_for_batch(
+        self,
+        batch_id: str,
+        poll_interval: int = 60
+    ) -> Dict[str, str]:
+        """
+        轮询批量任务直到完成，并下载结果
+
+        Args:
+            batch_id: 批量任务ID
+            poll_interval: 轮询间隔（秒）
+
+        Returns:
+            custom_id到回复内容的映射，失败返回空字典
+        """
+        headers = {}
+        if self.api_key:
+            headers["Authorization"] = f"Bearer {self.api_key}"
+
+        try:
+            # 复用共享会话，与chat_completion共享连接池
+            session = self._get_session()
+
+            while True:
+                async with session.get(
+                    f"{self.api_url}/batches/{batch_id}",
+                    headers=headers
+                ) as response:
+                    if response.status != 200:
+                        error_text = await response.text()
+                        self.logger.error(f"查询批量任务失败 (状态码 {response.status}): {error_text}")
+                        return {}
+                    batch = await response.json()
+
+                status = batch.get("status")
+                if status == "completed":
+                    break
+                if status in ("failed", "expired", "cancelled"):
+                    self.logger.error(f"批量任务{batch_id}终止: status={status}")
+                    return {}
+
+                self.logger.info(f"批量任务{batch_id}进行中: status={status}")
+                await asyncio.sleep(poll_interval)
+
+            # 3. 下载输出文件
+            output_file_id = batch.get("output_file_id")
+            if not output_file_id:
+                self.logger.error(f"批量任务{batch_id}缺少输出文件")
+                return {}
+
+            async with session.get(
+                f"{self.api_url}/files/{output_file_id}/content",
+                headers=headers
+            ) as response:
+                if response.status != 200:
+                    error_text = await response.text()
+                    self.logger.error(f"下载批量结果失败 (状态码 {response.status}): {error_text}")
+                    return {}
+                output_text = await response.text()
+
+            # 按custom_id整理结果
+            results = {}
+            for line in output_text.splitlines():
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    item = json.loads(line)
+                    content = item["response"]["body"]["choices"][0]["message"]["content"]
+                    results[item["custom_id"]] = content
+                except (KeyError, IndexError, TypeError, json.JSONDecodeError):
+                    self.logger.warning(f"无法解析批量结果行: {line[:100]}")
+
+            self.logger.info(f"批量任务{batch_id}完成: 成功解析 {len(results)} 条结果")
+            return results
+
+        except Exception as e:
+            self.logger.error(f"等待批量任务异常: {str(e)}")
+            return {}
+
     def set_model(self, model: str) -> None:
         """设置模型"""
         self.model = model
@@ -453,6 +1280,93 @@ Rejected回复：{sample.get('rejected', '')}
     def set_api_key(self, api_key: str) -> None:
         """设置API密钥"""
         self.api_key = api_key
+        self._headers = self._build_headers()
 
     def __repr__(self) -> str:
         return f"LLMClient(model={self.model}, api_url={self.api_url})"
+
+
+class LLMClientPool:
+    """多端点客户端池
+
+    把请求分摊到多个OpenAI兼容后端（例如云端API加自建vLLM）：每个
+    端点有独立的并发限额，新请求优先发往空闲槽位最多的端点，失败时
+    自动降级到下一个端点重试，吞吐随端点数量近似线性扩展。
+
+    暴露与LLMClient相同的chat_completion/chat_completion_batch签名，
+    作为传输层可直接替换单端点客户端；generate_*等高层方法仍属于
+    各端点自己的LLMClient实例。
+    """
+
+    def __init__(
+        self,
+        clients: List[LLMClient],
+        concurrency_per_endpoint: int = 10
+    ):
+        """
+        初始化客户端池
+
+        Args:
+            clients: 各端点的LLMClient实例列表
+            concurrency_per_endpoint: 每个端点的并发上限
+        """
+        if not clients:
+            raise ValueError("clients不能为空")
+        self.clients = clients
+        self.logger = setup_logger("LLMClientPool")
+        self._semaphores = [
+            asyncio.Semaphore(concurrency_per_endpoint) for _ in clients
+        ]
+
+    async def chat_completion(
+        self,
+        messages: List[Dict[str, str]],
+        **kwargs
+    ) -> Optional[str]:
+        """
+        在池内选择端点执行请求，失败时依次换端点重试
+
+        Args:
+            messages: 消息列表
+            **kwargs: 透传给LLMClient.chat_completion的参数
+
+        Returns:
+            模型回复内容，所有端点均失败返回None
+        """
+        # 按空闲槽位降序尝试：负载最轻的端点优先
+        order = sorted(
+            range(len(self.clients)),
+            key=lambda i: self._semaphores[i]._value,
+            reverse=True
+        )
+
+        for idx in order:
+            client = self.clients[idx]
+            async with self._semaphores[idx]:
+                result = await client.chat_completion(messages, **kwargs)
+            if result is not None:
+                return result
+            self.logger.warning(f"端点{client.api_url}请求失败，切换下一端点")
+
+        self.logger.error("所有端点均请求失败")
+        return None
+
+    async def chat_completion_batch(
+        self,
+        messages_list: List[List[Dict[str, str]]],
+        **kwargs
+    ) -> List[Optional[str]]:
+        """并发执行一批请求，逐项走端点选择与降级逻辑"""
+        if not messages_list:
+            return []
+        return list(await asyncio.gather(
+            *(self.chat_completion(messages, **kwargs) for messages in messages_list)
+        ))
+
+    async def aclose(self) -> None:
+        """关闭池内所有端点的HTTP会话"""
+        for client in self.clients:
+            await client.aclose()
+
+    def __repr__(self) -> str:
+        return f"LLMClientPool(endpoints={len(self.clients)})"
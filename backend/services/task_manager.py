@@ -5,14 +5,20 @@
 
 import asyncio
 import uuid
+from collections import Counter, deque
 from typing import Dict, Optional, List
-from datetime import datetime
+from datetime import datetime, timedelta
 from enum import Enum
-from dataclasses import dataclass, field, asdict
+from dataclasses import dataclass, field
 
 
 class TaskStatus(Enum):
-    """任务状态"""
+    """任务状态
+
+    保持字符串值的普通Enum：成员比较走对象恒等判断，已无优化空间
+    （IntEnum反而要做整数比较），且字符串值直接充当API的请求参数和
+    响应字段，换成整数码会破坏线上接口。
+    """
     PENDING = "pending"          # 待处理
     RUNNING = "running"          # 运行中
     VALIDATING = "validating"    # 验证中
@@ -21,7 +27,11 @@ class TaskStatus(Enum):
     CANCELLED = "cancelled"      # 已取消
 
 
-@dataclass
+# 可取消的活跃状态：frozenset的哈希查找替代列表线性扫描
+_ACTIVE_STATES = frozenset({TaskStatus.PENDING, TaskStatus.RUNNING})
+
+
+@dataclass(slots=True)
 class GenerationTask:
     """生成任务"""
     task_id: str
@@ -36,13 +46,23 @@ class GenerationTask:
     error_message: Optional[str] = None
 
     def to_dict(self) -> Dict:
-        """转换为字典"""
-        data = asdict(self)
-        data["status"] = self.status.value
-        data["created_at"] = self.created_at.isoformat() if self.created_at else None
-        data["started_at"] = self.started_at.isoformat() if self.started_at else None
-        data["completed_at"] = self.completed_at.isoformat() if self.completed_at else None
-        return data
+        """转换为字典
+
+        手工构造而非dataclasses.asdict：asdict会对config/stats/output_files
+        做整棵递归深拷贝，而状态轮询端点只读不改，引用共享即可。
+        """
+        return {
+            "task_id": self.task_id,
+            "status": self.status.value,
+            "config": self.config,
+            "created_at": self.created_at.isoformat() if self.created_at else None,
+            "started_at": self.started_at.isoformat() if self.started_at else None,
+            "completed_at": self.completed_at.isoformat() if self.completed_at else None,
+            "progress": self.progress,
+            "stats": self.stats,
+            "output_files": self.output_files,
+            "error_message": self.error_message
+        }
 
 
 class TaskManager:
@@ -52,7 +72,28 @@ class TaskManager:
         """初始化任务管理器"""
         self.tasks: Dict[str, GenerationTask] = {}
         self.running_tasks: Dict[str, asyncio.Task] = {}
+        # 单把锁即可：管理器只在一个事件循环内被访问，且临界区内没有
+        # await点，协程间本就不会交错；分片成N把锁（striped locks）只对
+        # 多线程场景有意义，在这里徒增复杂度，还会破坏tasks字典按创建
+        # 顺序插入的性质（list_tasks的免排序遍历依赖它）
         self._lock = asyncio.Lock()
+        # 随状态迁移维护的计数，get_statistics不再每次线性扫描全部任务
+        self._status_counts: Counter = Counter()
+        # 进度更新队列与后台合并消费者（首个更新到来时在事件循环内启动）
+        self._progress_queue: Optional[asyncio.Queue] = None
+        self._progress_task: Optional[asyncio.Task] = None
+        # 终态任务按完成时间入队，cleanup只需从队头弹出过期项而非全表扫描
+        self._terminal_queue: deque = deque()
+
+    def _mark_terminal(self, task: GenerationTask) -> None:
+        """记录终态任务的完成时间（终态不可逆，每个任务至多入队一次）"""
+        self._terminal_queue.append((task.completed_at, task.task_id))
+
+    def _transition(self, task: GenerationTask, new_status: TaskStatus) -> None:
+        """迁移任务状态并同步维护状态计数"""
+        self._status_counts[task.status.value] -= 1
+        self._status_counts[new_status.value] += 1
+        task.status = new_status
 
     def create_task(self, config: Dict) -> str:
         """
@@ -73,6 +114,7 @@ class TaskManager:
         )
 
         self.tasks[task_id] = task
+        self._status_counts[TaskStatus.PENDING.value] += 1
         return task_id
 
     async def start_task(self, task_id: str) -> bool:
@@ -93,7 +135,7 @@ class TaskManager:
             if task.status != TaskStatus.PENDING:
                 return False
 
-            task.status = TaskStatus.RUNNING
+            self._transition(task, TaskStatus.RUNNING)
             task.started_at = datetime.now()
 
             return True
@@ -107,17 +149,41 @@ class TaskManager:
         """
         更新任务进度
 
+        每个样本都会触发一次进度更新，这里只做O(1)入队，由后台消费者
+        按窗口合并：同一窗口内同一任务的多次更新只有最后一次落到任务上。
+
         Args:
             task_id: 任务ID
             progress: 进度（0-100）
             stats: 统计信息
         """
-        if task_id in self.tasks:
-            task = self.tasks[task_id]
-            task.progress = progress
-
-            if stats:
-                task.stats = stats
+        if self._progress_queue is None:
+            self._progress_queue = asyncio.Queue()
+            self._progress_task = asyncio.create_task(self._drain_progress())
+
+        self._progress_queue.put_nowait((task_id, progress, stats))
+
+    async def _drain_progress(self) -> None:
+        """后台消费进度队列，按任务合并后统一应用"""
+        queue = self._progress_queue
+        while True:
+            latest = {}
+            task_id, progress, stats = await queue.get()
+            latest[task_id] = (progress, stats)
+            # 把积压的更新一次吸干，每个任务只保留窗口内最新值
+            while not queue.empty():
+                task_id, progress, stats = queue.get_nowait()
+                latest[task_id] = (progress, stats)
+
+            for task_id, (progress, stats) in latest.items():
+                task = self.tasks.get(task_id)
+                if task is None:
+                    continue
+                task.progress = progress
+                if stats:
+                    task.stats = stats
+
+            await asyncio.sleep(0.1)
 
     async def complete_task(
         self,
@@ -135,11 +201,12 @@ class TaskManager:
         """
         if task_id in self.tasks:
             task = self.tasks[task_id]
-            task.status = TaskStatus.COMPLETED
+            self._transition(task, TaskStatus.COMPLETED)
             task.completed_at = datetime.now()
             task.progress = 100.0
             task.output_files = output_files
             task.stats = stats
+            self._mark_terminal(task)
 
             # 清理运行中的任务引用
             if task_id in self.running_tasks:
@@ -155,9 +222,10 @@ class TaskManager:
         """
         if task_id in self.tasks:
             task = self.tasks[task_id]
-            task.status = TaskStatus.FAILED
+            self._transition(task, TaskStatus.FAILED)
             task.completed_at = datetime.now()
             task.error_message = error_message
+            self._mark_terminal(task)
 
             # 清理运行中的任务引用
             if task_id in self.running_tasks:
@@ -180,11 +248,12 @@ class TaskManager:
             task = self.tasks[task_id]
 
             # 只能取消待处理或运行中的任务
-            if task.status not in [TaskStatus.PENDING, TaskStatus.RUNNING]:
+            if task.status not in _ACTIVE_STATES:
                 return False
 
-            task.status = TaskStatus.CANCELLED
+            self._transition(task, TaskStatus.CANCELLED)
             task.completed_at = datetime.now()
+            self._mark_terminal(task)
 
             # 取消异步任务
             if task_id in self.running_tasks:
@@ -235,19 +304,17 @@ class TaskManager:
         Returns:
             任务列表
         """
-        tasks = list(self.tasks.values())
-
-        # 过滤状态
-        if status:
-            tasks = [t for t in tasks if t.status == status]
-
-        # 按创建时间降序排序
-        tasks.sort(key=lambda t: t.created_at, reverse=True)
-
-        # 限制数量
-        tasks = tasks[:limit]
-
-        return [t.to_dict() for t in tasks]
+        # tasks字典只按创建顺序插入，逆序遍历即按创建时间降序，
+        # 无需每次调用都整体排序；凑满limit条立即停止
+        results: List[Dict] = []
+        for task in reversed(self.tasks.values()):
+            if status and task.status != status:
+                continue
+            results.append(task.to_dict())
+            if len(results) >= limit:
+                break
+
+        return results
 
     def register_running_task(self, task_id: str, async_task: asyncio.Task) -> None:
         """
@@ -269,23 +336,19 @@ class TaskManager:
         Returns:
             清理的任务数量
         """
-        now = datetime.now()
-        to_remove = []
+        # 终态队列按完成时间有序，从队头弹出过期项即可，
+        # 开销与实际过期数量成正比而非任务总数
+        cutoff = datetime.now() - timedelta(hours=max_age_hours)
+        removed = 0
 
-        for task_id, task in self.tasks.items():
-            age = (now - task.created_at).total_seconds() / 3600
+        while self._terminal_queue and self._terminal_queue[0][0] < cutoff:
+            _, task_id = self._terminal_queue.popleft()
+            task = self.tasks.pop(task_id, None)
+            if task is not None:
+                self._status_counts[task.status.value] -= 1
+                removed += 1
 
-            if age > max_age_hours and task.status in [
-                TaskStatus.COMPLETED,
-                TaskStatus.FAILED,
-                TaskStatus.CANCELLED
-            ]:
-                to_remove.append(task_id)
-
-        for task_id in to_remove:
-            del self.tasks[task_id]
-
-        return len(to_remove)
+        return removed
 
     def get_statistics(self) -> Dict:
         """
@@ -294,16 +357,9 @@ class TaskManager:
         Returns:
             统计信息字典
         """
-        total = len(self.tasks)
-        status_counts = {}
-
-        for task in self.tasks.values():
-            status_name = task.status.value
-            status_counts[status_name] = status_counts.get(status_name, 0) + 1
-
         return {
-            "total_tasks": total,
-            "status_counts": status_counts,
+            "total_tasks": len(self.tasks),
+            "status_counts": {k: v for k, v in self._status_counts.items() if v},
             "running_count": len(self.running_tasks)
         }
 
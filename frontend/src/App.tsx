@@ -129,10 +129,13 @@ export default function App() {
       // 建立WebSocket连接获取实时更新
       const ws = new WebSocket(`ws://localhost:8000/api/logs/${data.task_id}`);
 
-      ws.onmessage = (event) => {
-        const message = JSON.parse(event.data);
-
-        if (message.type === 'stats') {
+      const handleMessage = (message: any) => {
+        if (message.type === 'batch') {
+          // 后端批量帧：逐条处理其中的消息
+          for (const item of message.items ?? []) {
+            handleMessage(item);
+          }
+        } else if (message.type === 'stats') {
           const statsData = message.data;
           setStats({
             progress: statsData.progress_percent ?? 0,
@@ -173,6 +176,10 @@ export default function App() {
         }
       };
 
+      ws.onmessage = (event) => {
+        handleMessage(JSON.parse(event.data));
+      };
+
       ws.onerror = (error) => {
         console.error('WebSocket错误:', error);
         setProcessState('空闲');